@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import contextlib
+import cv2
+import functools
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+import catfd
+from lib.Detector import Detector
+from lib.DetectorResult import DetectorResult
+from lib.Frame import Frame
+from lib.ImageScanner import IMAGE_EXTENSIONS
+from lib.ImageScanner import ImageScanner
+
+STAGES = ['decode', 'detect', 'predict', 'chip', 'annotate', 'serialize']
+HEAVY_MODULES = ['cv2', 'dlib', 'numpy', 'PIL', 'skimage']
+STARTUP_TARGET_MS = 300
+
+
+def main():
+    def formatter(prog): return argparse.HelpFormatter(prog,
+                                                       max_help_position=36)
+    desc = '''
+    Benchmarks each stage of cat face detection and sweeps upsample factors
+    and worker counts
+    '''
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=formatter)
+
+    parser.add_argument('-f', '--input-folder',
+                        help='folder of images to benchmark with',
+                        default='samples',
+                        metavar='<path>')
+
+    parser.add_argument('-r', '--recursive',
+                        help='also scan the subfolders of -f',
+                        action='store_true')
+
+    parser.add_argument('-n', '--repeat',
+                        help='number of passes over the images',
+                        type=int,
+                        default=1,
+                        metavar='<int>')
+
+    parser.add_argument('-u', '--upsample',
+                        help='upsample factors to sweep',
+                        type=int,
+                        default=[1],
+                        nargs='+',
+                        metavar='<int>')
+
+    parser.add_argument('-m', '--max-size',
+                        help='downscale images larger than this to detect',
+                        type=int,
+                        metavar='<px>')
+
+    parser.add_argument('-w', '--workers',
+                        help='worker counts to sweep for end-to-end runs',
+                        type=int,
+                        default=[],
+                        nargs='+',
+                        metavar='<int>')
+
+    parser.add_argument('-j', '--json',
+                        help='print the results as JSON',
+                        action='store_true')
+
+    parser.add_argument('-o', '--output',
+                        help='also write the JSON results to a file',
+                        metavar='<file>')
+
+    parser.add_argument('-s', '--startup',
+                        help='''
+                        only check that catfd.py --help starts within
+                        --startup-target without importing dlib, NumPy,
+                        OpenCV, Pillow or scikit-image; exits non-zero if not
+                        ''',
+                        action='store_true')
+
+    parser.add_argument('--startup-target',
+                        help='startup time budget for --startup',
+                        type=float,
+                        default=STARTUP_TARGET_MS,
+                        metavar='<ms>')
+
+    args = vars(parser.parse_args())
+
+    if args['startup']:
+        result = check_startup(args['startup_target'])
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result['ok'] else 1)
+
+    files = list(ImageScanner(args['input_folder'],
+                              args['recursive'],
+                              IMAGE_EXTENSIONS))
+    if not files:
+        parser.error('no images found in {}'.format(args['input_folder']))
+
+    results = {
+        'images': len(files),
+        'repeat': args['repeat'],
+        'max_size': args['max_size'],
+        'stages': [],
+        'workers': [],
+    }
+
+    for upsample in args['upsample']:
+        d = Detector(upsample=upsample, max_size=args['max_size'])
+        results['stages'].append(bench_stages(files * args['repeat'], d))
+
+        for workers in args['workers']:
+            results['workers'].append(
+                bench_workers(files * args['repeat'], d, workers))
+
+    results['peak_rss'] = peak_rss()
+
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args['json']:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+def bench_stages(files, d):
+    """ Times every stage of detection separately on each image"""
+    timings = collections.defaultdict(list)
+    faces = 0
+
+    @contextlib.contextmanager
+    def timer(stage, same_image=False):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        if same_image:
+            # adds to this image's sample rather than counting a new one
+            timings[stage][-1] += elapsed
+        else:
+            timings[stage].append(elapsed)
+
+    start = time.perf_counter()
+    for f in files:
+        with timer('decode'):
+            frame = Frame.load(f, d.max_size)
+
+        with timer('detect'):
+            rects = d.find_frame_faces(frame)
+
+        # with -m, landmarks are predicted on a full resolution re-decode,
+        # which is part of decoding the image
+        with timer('decode', same_image=True):
+            if len(rects):
+                frame = frame.full()
+
+        with timer('predict'):
+            result = DetectorResult.from_dlib(rects,
+                                              d.predict(frame.data, rects))
+
+        with timer('chip'):
+            for box in result.boxes:
+                Image.fromarray(frame.chip(box)).save(io.BytesIO(), 'JPEG')
+
+        with timer('annotate'):
+            canvas = frame.copy()
+            for box, points in zip(result.boxes, result.landmarks):
+                catfd.draw_landmark_annotation(canvas.data, points,
+                                               (255, 50, 100), 1)
+                catfd.draw_face_annotation(canvas.data, box,
+                                           (25, 255, 100), 2)
+            cv2.imencode('.jpg', canvas.data)
+
+        with timer('serialize'):
+            json.dumps({'image': f, 'faces': result.to_json()})
+
+        faces += result.face_count
+    elapsed = time.perf_counter() - start
+
+    return {
+        'upsample': d.upsample,
+        'seconds': elapsed,
+        'images_per_second': len(files) / elapsed,
+        'faces_per_second': faces / elapsed,
+        'latency_ms': {s: percentiles(timings[s]) for s in STAGES},
+    }
+
+
+def bench_workers(files, d, workers):
+    """ Measures end-to-end throughput of catfd.detect with a worker pool"""
+    with tempfile.TemporaryDirectory() as output_path:
+        process = functools.partial(catfd.detect,
+                                    d=d,
+                                    output_path=output_path,
+                                    annotate_faces=False,
+                                    annotate_landmarks=False,
+                                    face_color=None,
+                                    landmark_color=None,
+                                    save_chip=False)
+        faces = 0
+        start = time.perf_counter()
+        for result in catfd.detect_all(process, files, workers, False):
+            faces += len(result['faces'])
+        elapsed = time.perf_counter() - start
+
+    return {
+        'upsample': d.upsample,
+        'workers': workers,
+        'seconds': elapsed,
+        'images_per_second': len(files) / elapsed,
+        'faces_per_second': faces / elapsed,
+    }
+
+
+def check_startup(target_ms, runs=5):
+    """ Measures how long catfd.py --help takes and what it imports"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'catfd.py')
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, '--help'],
+                       stdout=subprocess.DEVNULL,
+                       check=True)
+        times.append((time.perf_counter() - start) * 1000)
+
+    trace = subprocess.run([sys.executable, '-X', 'importtime', script,
+                            '--help'],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE,
+                           universal_newlines=True,
+                           check=True).stderr
+    imported = {line.rsplit('|', 1)[1].strip()
+                for line in trace.splitlines() if '|' in line}
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+    startup = float(np.median(times))
+
+    return {
+        'startup_ms': startup,
+        'target_ms': target_ms,
+        'heavy_imports': heavy,
+        'ok': startup <= target_ms and not heavy,
+    }
+
+
+def percentiles(samples):
+    """ Summarizes stage timings in milliseconds"""
+    ms = np.array(samples) * 1000
+    return {
+        'p50': float(np.percentile(ms, 50)),
+        'p95': float(np.percentile(ms, 95)),
+        'p99': float(np.percentile(ms, 99)),
+        'total': float(ms.sum()),
+    }
+
+
+def peak_rss():
+    """ Peak resident set size in bytes of this process and its workers"""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        'workers':
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def print_results(results):
+    for run in results['stages']:
+        print('\nupsample {}: {:.2f} images/s, {:.2f} faces/s'.format(
+            run['upsample'],
+            run['images_per_second'],
+            run['faces_per_second']))
+        print('   {:<10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for stage, t in run['latency_ms'].items():
+            print('   {:<10} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                stage, t['p50'], t['p95'], t['p99']))
+
+    if results['workers']:
+        print('\n   {:>8} {:>8} {:>10} {:>10}'.format(
+            'upsample', 'workers', 'images/s', 'faces/s'))
+        for run in results['workers']:
+            print('   {:>8} {:>8} {:>10.2f} {:>10.2f}'.format(
+                run['upsample'],
+                run['workers'],
+                run['images_per_second'],
+                run['faces_per_second']))
+
+    print('\npeak RSS: {:.1f} MB, workers {:.1f} MB'.format(
+        results['peak_rss']['self'] / 2 ** 20,
+        results['peak_rss']['workers'] / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
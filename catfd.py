@@ -1,14 +1,32 @@
 #!/usr/bin/env python3
 
 import argparse
-import cv2
-import glob
+import functools
+import itertools
+import json
 import os
-from PIL import Image
+import sys
 from lib.CatFaceLandmark import *
-from lib.Detector import Detector
-from skimage import io
-import dlib
+from lib.ImageScanner import IMAGE_EXTENSIONS
+from lib.ImageScanner import ImageScanner
+from lib.ImageWriter import IMAGE_FORMATS
+from lib.ImageWriter import ImageWriter
+from lib.InputSource import InputSource
+from lib.Instrumentation import Instrumentation
+from lib.ResultCache import ResultCache
+
+# dlib, NumPy, OpenCV and Pillow are slow to import, so they and the lib
+# modules built on them are imported by the functions that need them. This
+# keeps --help fast and JSON-only runs free of OpenCV.
+
+# threads of each --pipeline stage and size of the queues between stages
+PIPELINE_DEFAULTS = {
+    'read': 4,
+    'decode': 2,
+    'detect': 1,
+    'write': 2,
+    'queue': 8,
+}
 
 
 def main():
@@ -21,26 +39,120 @@ def main():
                                      formatter_class=formatter)
 
     parser.add_argument('-i', '--input-image',
-                        help='input image',
+                        help='input image, or - to read one image from stdin',
                         metavar='<file>')
 
     parser.add_argument('-f', '--input-folder',
                         help='input folder',
                         metavar='<path>')
 
+    parser.add_argument('--archive',
+                        help='''
+                        tar or zip archives, compressed or not, whose images
+                        are read straight from the archive; with several
+                        archives, outputs are kept under <archive>/
+                        ''',
+                        nargs='+',
+                        metavar='<file>')
+
+    parser.add_argument('--list',
+                        help='''
+                        file, or - for stdin, listing one image path or
+                        http(s) URL per line
+                        ''',
+                        metavar='<file>')
+
+    parser.add_argument('--boxes',
+                        help='''
+                        JSON Lines file, or - for stdin, of face boxes found
+                        elsewhere, e.g. by a previous -j run; only the
+                        landmarks of these boxes are predicted and the
+                        detector is not run. A record is either -j output or
+                        {"image": <file>, "boxes": [[left, top, right,
+                        bottom], ...]}
+                        ''',
+                        metavar='<file>')
+
+    parser.add_argument('-v', '--input-video',
+                        help='''
+                        input video file or camera index; writes one JSON
+                        record per frame
+                        ''',
+                        metavar='<file>')
+
+    parser.add_argument('-n', '--detect-every',
+                        help='''
+                        run the detector every n video frames and track the
+                        faces in between
+                        ''',
+                        type=int,
+                        default=10,
+                        metavar='<int>')
+
+    parser.add_argument('--motion-threshold',
+                        help='''
+                        also run the detector on video frames whose mean
+                        pixel change exceeds this value
+                        ''',
+                        type=float,
+                        metavar='<float>')
+
+    parser.add_argument('-r', '--recursive',
+                        help='''
+                        also scan the subfolders of -f, which are mirrored
+                        under -o by chips and annotated images
+                        ''',
+                        action='store_true')
+
+    parser.add_argument('-e', '--extensions',
+                        help='image file extensions to scan for with -f',
+                        default=IMAGE_EXTENSIONS,
+                        nargs='+',
+                        metavar='<ext>')
+
+    parser.add_argument('--shard',
+                        help='''
+                        only process shard i of n of the files in -f
+                        ''',
+                        type=shard,
+                        metavar='<i/n>')
+
     parser.add_argument('-o', '--output_path',
                         help='output location',
                         default='.',
                         metavar='<path>')
 
     parser.add_argument('-j', '--json',
-                        help='output face and landmark information to JSON',
+                        help='''
+                        output face and landmark information as JSON Lines,
+                        one record per image
+                        ''',
                         action='store_true')
 
     parser.add_argument('-c', '--save-chip',
                         help='save a cropped version of each detected cat face',
                         action='store_true')
 
+    parser.add_argument('-cs', '--chip-size',
+                        help='resize saved chips to this many pixels square',
+                        type=int,
+                        metavar='<px>')
+
+    parser.add_argument('--align-chips',
+                        help='rotate saved chips so that the eyes are level',
+                        action='store_true')
+
+    parser.add_argument('--chip-archive',
+                        help='''
+                        write chips into a single .tar, .tar.gz, .zip or .npy
+                        file instead of one file per chip; .npy needs -cs
+                        and is indexed by a <stem>.jsonl file of the image
+                        and face of each row.
+                        With -w, each worker writes its own archive named
+                        <stem>-<pid><ext> next to the given file
+                        ''',
+                        metavar='<file>')
+
     parser.add_argument('-a', '--annotate-faces',
                         help='draw a square around each detected cat face',
                         action='store_true')
@@ -51,6 +163,17 @@ def main():
                         ''',
                         action='store_true')
 
+    parser.add_argument('-af', '--annotate-format',
+                        help='annotated image format',
+                        choices=IMAGE_FORMATS,
+                        default='jpg')
+
+    parser.add_argument('-q', '--quality',
+                        help='JPEG/WebP quality of chips and annotated images',
+                        type=int,
+                        default=95,
+                        metavar='<int>')
+
     parser.add_argument('-ac', '--face-color',
                         help='face square color',
                         type=int,
@@ -63,46 +186,496 @@ def main():
                         default=[255, 50, 100],
                         nargs=3)
 
+    parser.add_argument('-u', '--upsample',
+                        help='''
+                        number of times to upsample each image before
+                        scanning it for faces
+                        ''',
+                        type=int,
+                        default=1,
+                        metavar='<int>')
+
+    parser.add_argument('-m', '--max-size',
+                        help='''
+                        downscale images whose longest side is larger than
+                        this before scanning them; landmarks are still found
+                        at full resolution
+                        ''',
+                        type=int,
+                        metavar='<px>')
+
+    parser.add_argument('--detectors',
+                        help='''
+                        FHOG detector models to run together on one HOG
+                        pyramid, e.g. the default model plus rotated or
+                        profile variants; faces are tagged with the model
+                        that found them and its confidence
+                        ''',
+                        nargs='+',
+                        metavar='<svm>')
+
+    parser.add_argument('--tile',
+                        help='''
+                        scan images larger than this in overlapping tiles of
+                        this size, so memory is bounded by the tile size
+                        ''',
+                        type=int,
+                        metavar='<px>')
+
+    parser.add_argument('--tile-overlap',
+                        help='''
+                        pixels adjacent tiles overlap by; should be at least
+                        the largest face size, defaults to a quarter tile
+                        ''',
+                        type=int,
+                        metavar='<px>')
+
+    parser.add_argument('--tile-workers',
+                        help='''
+                        number of worker processes scanning the tiles of each
+                        image; use with -w 1
+                        ''',
+                        type=int,
+                        default=1,
+                        metavar='<int>')
+
+    parser.add_argument('-w', '--workers',
+                        help='number of worker processes for -f',
+                        type=int,
+                        default=1,
+                        metavar='<int>')
+
+    parser.add_argument('--pipeline',
+                        help='''
+                        process images in a pipeline of read, decode, detect
+                        and write stages with their own threads, so file I/O
+                        overlaps with compute; optionally sets the threads of
+                        each stage and the queue size between stages, e.g.
+                        read=8,decode=2,detect=1,write=2,queue=16
+                        ''',
+                        nargs='?',
+                        const='',
+                        type=pipeline_spec,
+                        metavar='<spec>')
+
+    parser.add_argument('--order',
+                        help='''
+                        emit -f results in input order or as they complete
+                        ''',
+                        choices=['input', 'completion'],
+                        default='input')
+
+    parser.add_argument('--cache',
+                        help='''
+                        SQLite file caching results by image content and
+                        model version; faces are not detected again in
+                        cached images, which are only decoded to write any
+                        requested chips and annotations
+                        ''',
+                        metavar='<file>')
+
+    parser.add_argument('--cache-size',
+                        help='''
+                        evict least recently used cache entries beyond this
+                        many megabytes
+                        ''',
+                        type=float,
+                        metavar='<MB>')
+
+    parser.add_argument('--serve',
+                        help='''
+                        run an HTTP detection service; POST images to
+                        /detect, metrics are served on /metrics
+                        ''',
+                        action='store_true')
+
+    parser.add_argument('--bind',
+                        help='address for --serve',
+                        default='127.0.0.1:8080',
+                        metavar='<host:port>')
+
+    parser.add_argument('--socket',
+                        help='serve on a Unix socket instead of --bind',
+                        metavar='<path>')
+
+    parser.add_argument('--batch-window',
+                        help='milliseconds to wait while filling a batch',
+                        type=float,
+                        default=5,
+                        metavar='<ms>')
+
+    parser.add_argument('--max-batch',
+                        help='most images sent to a worker at once',
+                        type=int,
+                        default=16,
+                        metavar='<int>')
+
+    parser.add_argument('--max-queue',
+                        help='''
+                        most images waiting for a worker before requests are
+                        rejected
+                        ''',
+                        type=int,
+                        default=256,
+                        metavar='<int>')
+
+    parser.add_argument('--timings',
+                        help='''
+                        report per-stage timings to a sink: stderr,
+                        jsonl:<file> or prom:<file>; may be repeated
+                        ''',
+                        action='append',
+                        default=[],
+                        metavar='<sink>')
+
+    parser.add_argument('--profile',
+                        help='''
+                        write cProfile statistics of the main process to a
+                        file for pstats or snakeviz
+                        ''',
+                        metavar='<file>')
+
     args = vars(parser.parse_args())
+
+    timings = Instrumentation.current()
+    try:
+        for spec in args['timings']:
+            timings.add_sink(Instrumentation.sink(spec))
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    if args['profile']:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, parser, args)
+        finally:
+            profiler.dump_stats(args['profile'])
+    else:
+        run(parser, args)
+
+    timings.close()
+
+
+def run(parser, args):
+    """ Runs the mode selected on the command line"""
     use_dlib = False
 
-    if not args['input_image'] and not args['input_folder']:
-        parser.error("must specify either -i or -f")
-
-    if args['input_image']:
-        if use_dlib:
-            dlib_detect(args['input_image'])
-        else:
-            detect(args['input_image'],
-                   args['output_path'],
-                   args['json'],
-                   args['annotate_faces'],
-                   args['annotate_landmarks'],
-                   args['face_color'],
-                   args['landmark_color'],
-                   args['save_chip'])
+    if args['pipeline'] is not None and args['workers'] > 1:
+        parser.error("--pipeline cannot be combined with -w")
+
+    if args['tile_workers'] > 1 and args['workers'] > 1:
+        parser.error("--tile-workers cannot be combined with -w")
+
+    if args['tile_overlap'] is not None and args['tile'] and \
+            not 0 <= args['tile_overlap'] < args['tile']:
+        parser.error("--tile-overlap must be smaller than --tile")
+
+    from lib.Detector import Detector
+    from lib.Trainer import DETECTOR_SVM
+    detector = Detector(args['detectors'] or DETECTOR_SVM,
+                        upsample=args['upsample'],
+                        max_size=args['max_size'],
+                        tile_size=args['tile'],
+                        tile_overlap=args['tile_overlap'],
+                        tile_workers=args['tile_workers'])
+
+    if args['serve']:
+        from lib.DetectionServer import DetectionServer
+        host, _, port = args['bind'].rpartition(':')
+        server = DetectionServer(functools.partial(detect_images, d=detector),
+                                 args['workers'],
+                                 args['batch_window'] / 1000,
+                                 args['max_batch'],
+                                 args['max_queue'],
+                                 detector_svm=detector.detector_svms,
+                                 predictor_dat=detector.predictor_dat)
+        server.serve(host, int(port), args['socket'])
+        return
+
+    if args['boxes'] and (args['input_image'] or args['input_folder'] or
+                          args['input_video'] or args['archive'] or
+                          args['list']):
+        parser.error("--boxes cannot be combined with -i, -f, -v, --archive "
+                     "or --list")
+
+    if args['boxes'] and (args['pipeline'] is not None or args['cache']):
+        parser.error("--boxes cannot be combined with --pipeline or --cache")
+
+    if (not args['input_image'] and not args['input_folder'] and
+            not args['input_video'] and not args['archive'] and
+            not args['list'] and not args['boxes']):
+        parser.error("must specify either -i, -f, -v, --archive, --list or "
+                     "--boxes")
+
+    if args['input_image'] == '-' and args['list'] == '-':
+        parser.error("-i - and --list - cannot both read stdin")
+
+    if (args['chip_archive'] and args['chip_archive'].endswith('.npy') and
+            not args['chip_size']):
+        parser.error("a .npy --chip-archive requires -cs")
+
+    if args['input_video']:
+        detect_video(args['input_video'],
+                     detector,
+                     args['detect_every'],
+                     args['motion_threshold'])
+
+    files = []
+    if args['input_image'] == '-':
+        files = [InputSource.stdin_image()]
+    elif args['input_image']:
+        files = [args['input_image']]
 
     if args['input_folder']:
-        for f in glob.glob(os.path.join(args['input_folder'], '*.jp*g')):
-            if use_dlib:
-                dlib_detect(f)
-            else:
-                detect(f,
-                       args['output_path'],
-                       args['json'],
-                       args['annotate_faces'],
-                       args['annotate_landmarks'],
-                       args['face_color'],
-                       args['landmark_color'],
-                       args['save_chip'])
-
-
-def dlib_detect(filename):
+        files = itertools.chain(files, ImageScanner(args['input_folder'],
+                                                    args['recursive'],
+                                                    args['extensions'],
+                                                    args['shard']))
+
+    for archive in args['archive'] or ():
+        files = itertools.chain(files, InputSource.archive(archive,
+                                                           args['extensions']))
+
+    if args['list']:
+        listing = sys.stdin if args['list'] == '-' else open(args['list'])
+        files = itertools.chain(files, InputSource.paths(listing))
+
+    if use_dlib:
+        for f in files:
+            dlib_detect(f, detector)
+        return
+
+    cache = None
+    if args['cache']:
+        max_bytes = None
+        if args['cache_size'] is not None:
+            max_bytes = int(args['cache_size'] * 1024 * 1024)
+        cache = ResultCache(args['cache'], detector.version, max_bytes)
+
+    outputs = {
+        'output_path': args['output_path'],
+        'annotate_faces': args['annotate_faces'],
+        'annotate_landmarks': args['annotate_landmarks'],
+        'annotate_format': args['annotate_format'],
+        'quality': args['quality'],
+        'face_color': args['face_color'],
+        'landmark_color': args['landmark_color'],
+        'save_chip': args['save_chip'],
+        'chip_size': args['chip_size'],
+        'align_chips': args['align_chips'],
+        'chip_archive': args['chip_archive'],
+        'input_roots': input_roots(args['input_folder'], args['archive']),
+    }
+
+    lookup = cache.lookup if cache else None
+    if cache and (args['save_chip'] or args['annotate_faces'] or
+                  args['annotate_landmarks']):
+        lookup = functools.partial(write_cached, lookup=lookup, **outputs)
+
+    if args['boxes']:
+        listing = sys.stdin if args['boxes'] == '-' else open(args['boxes'])
+        results = detect_all(functools.partial(landmark, d=detector,
+                                               **outputs),
+                             InputSource.boxes(listing),
+                             args['workers'],
+                             args['order'] == 'input',
+                             predictor_dat=detector.predictor_dat)
+    elif args['pipeline'] is not None:
+        results = detect_pipeline(files,
+                                  detector,
+                                  outputs,
+                                  args['pipeline'],
+                                  args['order'] == 'input',
+                                  lookup)
+    else:
+        results = detect_all(functools.partial(detect, d=detector, **outputs),
+                             files,
+                             args['workers'],
+                             args['order'] == 'input',
+                             lookup,
+                             detector.detector_svms,
+                             detector.predictor_dat)
+
+    timings = Instrumentation.current()
+    errors = 0
+    try:
+        for result in results:
+            timings.record(result.pop('timings', None), result['image'])
+            errors += 'error' in result
+            if cache:
+                cache.store(result)
+            print_result(result, args['json'])
+    finally:
+        # results computed before a failure are still saved
+        try:
+            if args['save_chip']:
+                from lib.ChipWriter import ChipWriter
+                ChipWriter.close_shared()
+            ImageWriter.close_shared()
+            detector.close()
+        finally:
+            if cache:
+                cache.close()
+                print(cache.stats(), file=sys.stderr)
+            if errors:
+                print('{} images could not be processed'.format(errors),
+                      file=sys.stderr)
+
+
+def detect_all(process, files, workers, ordered, lookup=None,
+               detector_svm=None, predictor_dat=None):
+    """
+        Yields the result of process for every file, using a pool of worker
+        processes when workers > 1, which preload the given models. Files
+        for which lookup returns a result are not processed.
+    """
+    process = functools.partial(guarded, process)
+    if lookup:
+        lookup = functools.partial(guarded, lookup)
+
+    if workers > 1:
+        from lib.WorkerPool import WorkerPool
+        with WorkerPool(workers, detector_svm, predictor_dat) as pool:
+            yield from pool.map(process, files, ordered, lookup)
+        return
+
+    for f in files:
+        result = lookup(f) if lookup else None
+        yield result if result is not None else process(f)
+
+
+def guarded(process, image):
+    """
+        Runs process on an image, returning an error record instead of
+        raising, so one unreadable image does not end a long run
+    """
+    try:
+        return process(image)
+    except Exception as e:
+        return error_record(image, e)
+
+
+def error_record(image, error):
+    """ Returns the result record of an image that could not be processed"""
+    return {'image': InputSource.name(image),
+            'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def detect_video(input_video, d, detect_every, motion_threshold):
+    """ Prints a JSON Lines record with the faces found in every video frame"""
+    from lib.VideoDetector import VideoDetector
+    video = VideoDetector(d, detect_every, motion_threshold)
+    for index, timestamp, result in video.run(input_video):
+        print(json.dumps({
+            'frame': index,
+            'time': timestamp,
+            'faces': result.to_json()
+        }), flush=True)
+
+
+def detect_pipeline(files, d, outputs, threads, ordered, lookup=None):
+    """
+        Yields the result for every file from a pipeline of read, decode,
+        detect and write stages that each run in their own threads, so that
+        reading files overlaps with decoding, detection and encoding. The
+        timings of each image are captured stage by stage and travel with
+        it. Prints the work and queue depth of each stage when done.
+    """
+    from lib.Frame import Frame
+    from lib.Pipeline import Pipeline
+    timings = Instrumentation.current()
+
+    def read(image):
+        with timings.capture() as events, timings.stage('read'):
+            image = InputSource.name(image), InputSource.read(image)
+        # the cache is keyed from the bytes just read, so a file is only
+        # read once
+        result = lookup(image) if lookup else None
+        if result is not None:
+            return Pipeline.done(result)
+        return image + (events,)
+
+    def decode(item):
+        filename, data, events = item
+        with timings.capture() as found, timings.stage('decode'):
+            frame = Frame.from_bytes(data, filename, d.max_size)
+        return filename, frame, events + found
+
+    def find(item):
+        filename, frame, events = item
+        with timings.capture() as found:
+            result = d.detect_frame(frame)
+        return filename, frame, result, events + found
+
+    def write(item):
+        filename, frame, result, events = item
+        with timings.capture() as found:
+            faces = write_outputs(filename, frame, result, **outputs)
+        return {'image': filename,
+                'faces': faces,
+                'timings': events + found}
+
+    def guard(fn):
+        # a failed image skips the remaining stages as an error record
+        def stage(item):
+            try:
+                return fn(item)
+            except Exception as e:
+                return Pipeline.done(error_record(item, e))
+        return stage
+
+    pipeline = Pipeline(threads.get('queue', PIPELINE_DEFAULTS['queue']))
+    for name, fn in (('read', read),
+                     ('decode', decode),
+                     ('detect', find),
+                     ('write', write)):
+        pipeline.add(name, guard(fn),
+                     threads.get(name, PIPELINE_DEFAULTS[name]))
+
+    yield from pipeline.run(files, ordered)
+
+    print('{:<8} {:>7} {:>7} {:>8} {:>10} {:>9}'.format(
+        'stage', 'threads', 'items', 'busy s', 'mean queue', 'max queue'),
+        file=sys.stderr)
+    for stage in pipeline.stats():
+        print('{stage:<8} {threads:>7} {items:>7} {busy:>8.2f} '
+              '{mean_depth:>10.2f} {max_depth:>9}'.format(**stage),
+              file=sys.stderr)
+
+
+def pipeline_spec(value):
+    """ Argument type for --pipeline, e.g. read=8,detect=1,queue=16"""
+    threads = {}
+    for part in filter(None, value.split(',')):
+        name, _, count = part.partition('=')
+        if name not in PIPELINE_DEFAULTS or not count.isdigit() or \
+                int(count) < 1:
+            raise argparse.ArgumentTypeError(
+                "expected stage=count pairs for {}, got '{}'".format(
+                    ', '.join(PIPELINE_DEFAULTS), part))
+        threads[name] = int(count)
+    return threads
+
+
+def shard(value):
+    """ Argument type for --shard"""
+    try:
+        return ImageScanner.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def dlib_detect(filename, d):
     """Applies the detector on a given file and uses dlib to show the results"""
+    import dlib
     print("Showing detections and predictions on the images in the faces folder...")
     win = dlib.image_window()
-    print("Processing file: {}".format(filename))
-    img = dlib.load_rgb_image(filename)
+    print("Processing file: {}".format(InputSource.name(filename)))
+    if isinstance(filename, str):
+        img = dlib.load_rgb_image(filename)
+    else:
+        img = InputSource.frame(filename).data
 
     win.clear_overlay()
     win.set_image(img)
@@ -110,11 +683,10 @@ def dlib_detect(filename):
     # Ask the detector to find the bounding boxes of each face. The 1 in the
     # second argument indicates that we should upsample the image 1 time. This
     # will make everything bigger and allow us to detect more faces.
-    d = Detector(filename)
-    d.detect()
-    dets = d.result.face_count
+    faces = d.find_faces(img)
+    dets = len(faces)
     print("Number of faces detected: {}".format(dets))
-    for k, face in enumerate(d.result.faces):
+    for k, face in enumerate(faces):
         print("Detection {}: Left: {} Top: {} Right: {} Bottom: {}".format(
             k, face.left(), face.top(), face.right(), face.bottom()))
         # Get the landmarks/parts for the face in box d.
@@ -124,126 +696,221 @@ def dlib_detect(filename):
         # Draw the face landmarks on the screen.
         win.add_overlay(shape)
 
-    win.add_overlay(d.result.faces)
+    win.add_overlay(faces)
     dlib.hit_enter_to_continue()
 
 
-def detect(input_image, output_path, use_json, annotate_faces,
-           annotate_landmarks, face_color, landmark_color, save_chip):
+def detect(input_image, d, output_path, annotate_faces, annotate_landmarks,
+           face_color, landmark_color, save_chip, annotate_format='jpg',
+           quality=95, chip_size=None, align_chips=False, chip_archive=None,
+           input_roots=()):
+    """
+        Applies the detector on a given file, or (name, bytes) image from
+        an InputSource, saves any requested chips and annotations and returns
+        the faces found. Chips and annotated images are encoded in the
+        background by the shared ImageWriter.
     """
-        Applies the detector on a given file and uses opencv to show the results
+    timings = Instrumentation.current()
+    with timings.stage('decode'):
+        frame = InputSource.frame(input_image, d.max_size)
+    result = d.detect_frame(frame)
+
+    name = InputSource.name(input_image)
+    faces = write_outputs(name, frame, result, output_path,
+                          annotate_faces, annotate_landmarks, face_color,
+                          landmark_color, save_chip, annotate_format, quality,
+                          chip_size, align_chips, chip_archive, input_roots)
+    return {'image': name,
+            'faces': faces,
+            'timings': timings.drain()}
+
+
+def landmark(item, d, **outputs):
     """
-    img = io.imread(input_image)
-    d = Detector(input_image)
-    d.detect()
+        Predicts the landmarks of an (image, boxes) pair read from --boxes
+        without running the detector, then saves chips and annotations and
+        returns the faces like detect
+    """
+    image, boxes = item
+    timings = Instrumentation.current()
+    with timings.stage('decode'):
+        frame = InputSource.frame(image)
+    with timings.stage('predict'):
+        result = d.landmark(frame.data, boxes)
 
-    if use_json:
-        json = []
-    else:
-        print(('\nImage: {}'.format(input_image)))
-        print(('Number of cat faces detected: {}'.format(d.result.face_count)))
+    name = InputSource.name(image)
+    return {'image': name,
+            'faces': write_outputs(name, frame, result, **outputs),
+            'timings': timings.drain()}
 
-    if annotate_faces or annotate_landmarks:
-        w = img.shape[1]
 
-    for i, face in enumerate(d.result.faces):
-        shape = d.predictor(img, face)
-
-        if save_chip:
-            cropped = Image.open(input_image)
-            cropped = cropped.crop((face.left(),
-                                    face.top(),
-                                    face.right(),
-                                    face.bottom()))
-
-            chip_path = get_output_file(output_path,
-                                        input_image,
-                                        '_face_{}'.format(i),
-                                        'jpg')
-            cropped.save(chip_path)
-
-        if annotate_landmarks:
-            draw_landmark_annotation(img, shape, landmark_color, 1)
-            #  int(w * 0.0025))
-
-        if annotate_faces:
-            draw_face_annotation(img, face, face_color, int(w * 0.005))
-
-        if use_json:
-            json.append(get_face_json(face, shape))
-        else:
-            print_face_info(i, face, shape)
-
-    if d.result.face_count > 0:
-        if annotate_faces or annotate_landmarks:
+def write_cached(image, lookup, **outputs):
+    """
+        Looks up the faces of an image in the cache and, on a hit, decodes
+        the image to write the chips and annotations requested for them, so
+        only detection is skipped
+    """
+    from lib.DetectorResult import DetectorResult
+    result = lookup(image)
+    if result is None:
+        return None
+
+    timings = Instrumentation.current()
+    with timings.capture() as events:
+        with timings.stage('decode'):
+            frame = InputSource.frame(image)
+        write_outputs(result['image'], frame,
+                      DetectorResult.from_json(result['faces']), **outputs)
+    result['timings'] = events
+    return result
+
+
+def write_outputs(input_image, frame, result, output_path, annotate_faces,
+                  annotate_landmarks, face_color, landmark_color, save_chip,
+                  annotate_format='jpg', quality=95, chip_size=None,
+                  align_chips=False, chip_archive=None, input_roots=()):
+    """
+        Saves the chips and annotations requested for the faces found in a
+        frame and returns the faces as JSON. Outputs are named after the
+        image's path under the first of input_roots that contains it.
+    """
+    timings = Instrumentation.current()
+    name = output_name(input_image, input_roots)
+    if result.face_count > 0:
+        frame = frame.full()
+
+    annotate = annotate_faces or annotate_landmarks
+    if annotate:
+        canvas = frame.copy()
+        w = frame.width
+
+    if save_chip:
+        from lib.ChipWriter import ChipWriter
+        chips = ChipWriter.shared(output_path,
+                                  chip_archive,
+                                  chip_size,
+                                  align_chips,
+                                  quality)
+        with timings.stage('crop'):
+            chips.write(frame, result, name, input_image)
+
+    with timings.stage('annotate'):
+        for box, points in zip(result.boxes, result.landmarks):
+            if annotate_landmarks:
+                draw_landmark_annotation(canvas.data, points, landmark_color, 1)
+                #  int(w * 0.0025))
+
+            if annotate_faces:
+                draw_face_annotation(canvas.data, box, face_color,
+                                     int(w * 0.005))
+
+    if result.face_count > 0:
+        if annotate:
             filename = get_output_file(output_path,
-                                       input_image,
+                                       name,
                                        '_annotated',
-                                       'jpg')
+                                       annotate_format)
 
-            cv2.imshow(filename, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
-            cv2.waitKey()
+            ImageWriter.shared().write(filename, canvas.data, quality)
 
+    return result.to_json()
+
+
+def detect_images(images, d):
+    """
+        Detects faces in a batch of encoded images, returning the faces found
+        or the exception raised for each image
+    """
+    from lib.Frame import Frame
+    results = []
+    for data in images:
+        try:
+            frame = Frame.from_bytes(data, max_size=d.max_size)
+            results.append(d.detect_frame(frame).to_json())
+        except Exception as e:
+            results.append(e)
+    # the server keeps its own request metrics, so stage timings buffered
+    # by a long-lived worker are dropped rather than left to grow
+    Instrumentation.current().drain()
+    return results
+
+
+def print_result(result, use_json):
+    """ Prints the faces found in a single image"""
     if use_json:
-        print(json)
+        print(json.dumps(result), flush=True)
+        return
 
+    print(('\nImage: {}'.format(result['image'])))
+    if 'error' in result:
+        print(('Error: {}'.format(result['error'])), flush=True)
+        return
+    print(('Number of cat faces detected: {}'.format(len(result['faces']))))
+    for i, face in enumerate(result['faces']):
+        print_face_info(i, face['face'])
+    sys.stdout.flush()
 
-def get_output_file(output_path, input_image, extra, ext):
-    """ Gets output filepath from input path """
-    if not os.path.isdir(output_path):
-        os.makedirs(output_path)
 
-    basename = os.path.splitext(os.path.basename(input_image))[0]
-    return os.path.join(output_path, basename + str(extra) + '.' + ext)
+def input_roots(folder, archives):
+    """
+        Returns the roots that output names are relative to: the -f folder
+        and each archive, or the folder of the archives when there are
+        several, so that their outputs are kept apart under <archive>/
+    """
+    archives = archives or []
+    if len(archives) > 1:
+        archives = [os.path.dirname(os.path.abspath(a)) for a in archives]
+    return tuple(filter(None, [folder] + archives))
+
 
+def output_name(input_image, roots=()):
+    """
+        Names the outputs of an image after its path under the first root
+        that contains it, e.g. a/cat for <root>/a/cat.jpg, so that images
+        with the same name in different subfolders do not overwrite each
+        other. Other images are named after their basename.
+    """
+    for root in roots:
+        relative = os.path.relpath(input_image, root)
+        if relative != os.pardir and \
+                not relative.startswith(os.pardir + os.sep):
+            return os.path.splitext(relative)[0]
+    return os.path.splitext(os.path.basename(input_image))[0]
 
-def print_face_info(i, face, shape):
+
+def get_output_file(output_path, name, extra, ext):
+    """ Gets output filepath from an output_name, creating its folder """
+    filename = os.path.join(output_path, name + str(extra) + '.' + ext)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    return filename
+
+
+def print_face_info(i, face):
     """ Prints the landmark and bounding box coordinates"""
     print(('Face #{}: ({}, {}), ({}, {})'.format(
         i,
-        face.top(),
-        face.left(),
-        face.right(),
-        face.bottom()
+        face['top'],
+        face['left'],
+        face['right'],
+        face['bottom']
     )))
 
-    for landmark in CatFaceLandmark.all():
-        print(('   {}: ({}, {})'.format(
-            landmark['name'],
-            shape.part(landmark['value']).x,
-            shape.part(landmark['value']).y
-        )))
-
-
-def get_face_json(face, shape):
-    landmarks = {}
-    for landmark in CatFaceLandmark.all():
-        landmarks[landmark['name']] = [shape.part(landmark['value']).x,
-                                       shape.part(landmark['value']).y]
-
-    return {
-        "face": {
-            'left': face.left(),
-            'top': face.top(),
-            'right': face.right(),
-            'bottom': face.bottom(),
-            'height': face.bottom() - face.top(),
-            'width': face.right() - face.left(),
-            'landmarks': landmarks
-        }
-    }
+    for name, point in face['landmarks'].items():
+        print(('   {}: ({}, {})'.format(name, point[0], point[1])))
 
 
-def draw_face_annotation(img, face, color, width):
+def draw_face_annotation(img, box, color, width):
     """draws bounding box of face on given image"""
+    import cv2
+    left, top, right, bottom = box.tolist()
     cv2.rectangle(img,
-                  (face.left(), face.top()),
-                  (face.right(), face.bottom()),
+                  (left, top),
+                  (right, bottom),
                   color,
                   width)
 
 
-def draw_landmark_annotation(img, shape, color, width):
+def draw_landmark_annotation(img, points, color, width):
     """ Draws face landmarks of given image"""
     lines = [
         [CatFaceLandmark.LEFT_EYE, CatFaceLandmark.RIGHT_EYE],
@@ -258,17 +925,20 @@ def draw_landmark_annotation(img, shape, color, width):
         [CatFaceLandmark.RIGHT_OF_RIGHT_EAR, CatFaceLandmark.MOUTH],
     ]
 
+    points = points.tolist()
     for i in lines:
-        draw_line(img, shape.part(i[0]), shape.part(i[1]), color, width)
+        draw_line(img, points[i[0]], points[i[1]], color, width)
 
 
-def draw_line(img, shape1, shape2, color, width):
+def draw_line(img, point1, point2, color, width):
     """draws line connecting landmarks"""
-    pt1 = (shape1.x, shape1.y)
-    pt2 = (shape2.x, shape2.y)
+    import cv2
+    pt1 = tuple(point1)
+    pt2 = tuple(point2)
     cv2.circle(img, pt1, radius=5, color=(0, 0, 255), thickness=-1)
     cv2.circle(img, pt2, radius=5, color=(0, 0, 255), thickness=-1)
     cv2.line(img, pt1, pt2, color, width, cv2.LINE_AA)
 
 
-main()
+if __name__ == '__main__':
+    main()
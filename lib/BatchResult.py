@@ -0,0 +1,27 @@
+import numpy as np
+from lib.DetectorResult import DetectorResult
+
+
+class BatchResult(DetectorResult):
+    """
+    Faces found in a batch of images. In addition to the DetectorResult
+    arrays, image_index holds the position of each face's image in the batch.
+    """
+    __slots__ = ('image_index', 'image_count')
+
+    def __init__(self, boxes, landmarks, image_index, image_count,
+                 scores=None, models=None):
+        DetectorResult.__init__(self, boxes, landmarks, scores, models)
+        self.image_index = np.asarray(image_index, dtype=np.int32)
+        self.image_count = image_count
+
+    def faces_per_image(self):
+        return np.bincount(self.image_index, minlength=self.image_count)
+
+    def for_image(self, i):
+        """Returns the faces found in the i-th image"""
+        mask = self.image_index == i
+        if self.scores is None:
+            return DetectorResult(self.boxes[mask], self.landmarks[mask])
+        return DetectorResult(self.boxes[mask], self.landmarks[mask],
+                              self.scores[mask], self.models[mask])
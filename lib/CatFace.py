@@ -2,6 +2,10 @@ import xml.etree.ElementTree as et
 import numpy as np
 from dlib import rectangle
 
+# part names in the order they appear in a .cat annotation
+LANDMARKS = ("LEFT_EYE", "RIGHT_EYE", "MOUTH", "LEFT_OF_LEFT_EAR", "TIP_OF_LEFT_EAR",
+             "RIGHT_OF_LEFT_EAR", "LEFT_OF_RIGHT_EAR", "TIP_OF_RIGHT_EAR", "RIGHT_OF_RIGTH_EAR")
+
 
 class CatFace:
     """ 
@@ -44,21 +48,27 @@ class CatFace:
 
     def GenerateXML(self):
         """Creates the XML annotation fo this face in the format for dlib"""
-        image = et.Element("image")
-        image.set('file', self.file)
-        box = et.SubElement(image, "box")
-        for key, val in self.box.items():
-            box.set(key, "%s" % val)
+        return CatFace.element(self.file,
+                               self.box,
+                               [self.features[name] for name in LANDMARKS])
 
-        landmarks = ["LEFT_EYE", "RIGHT_EYE", "MOUTH", "LEFT_OF_LEFT_EAR", "TIP_OF_LEFT_EAR",
-                     "RIGHT_OF_LEFT_EAR", "LEFT_OF_RIGHT_EAR", "TIP_OF_RIGHT_EAR", "RIGHT_OF_RIGTH_EAR"]
+    @staticmethod
+    def element(filename, box, points):
+        """
+        Creates the dlib XML annotation for a face from its box dict and its
+        (x, y) landmark points in LANDMARKS order
+        """
+        image = et.Element("image")
+        image.set('file', filename)
+        xml_box = et.SubElement(image, "box")
+        for key, val in box.items():
+            xml_box.set(key, "%s" % val)
 
-        for landmark in landmarks:
-            point = self.features[landmark]
-            part = et.SubElement(box, "part")
+        for landmark, point in zip(LANDMARKS, points):
+            part = et.SubElement(xml_box, "part")
             part.set('name', landmark)
-            part.set('x', point[0])
-            part.set('y', point[1])
+            part.set('x', "%s" % point[0])
+            part.set('y', "%s" % point[1])
 
         return image
 
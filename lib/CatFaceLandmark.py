@@ -9,47 +9,37 @@ class CatFaceLandmark:
     LEFT_OF_RIGHT_EAR = 2
     TIP_OF_RIGHT_EAR = 8
     RIGHT_OF_RIGHT_EAR = 6
+    COUNT = 9
+
+    # landmark names and their shape predictor part indices, in output order
+    NAMES = (
+        'Left Eye',
+        'Right Eye',
+        'Mouth',
+        'Left of Left Ear',
+        'Tip of Left Ear',
+        'Right of Left Ear',
+        'Left of Right Ear',
+        'Tip of Right Ear',
+        'Right of Right Ear',
+    )
+    ORDER = (
+        LEFT_EYE,
+        RIGHT_EYE,
+        MOUTH,
+        LEFT_OF_LEFT_EAR,
+        TIP_OF_LEFT_EAR,
+        RIGHT_OF_LEFT_EAR,
+        LEFT_OF_RIGHT_EAR,
+        TIP_OF_RIGHT_EAR,
+        RIGHT_OF_RIGHT_EAR,
+    )
 
     def __init__(self):
         pass
 
     @staticmethod
     def all():
-        return [
-            {
-                'value': CatFaceLandmark.LEFT_EYE,
-                'name': 'Left Eye'
-            },
-            {
-                'value': CatFaceLandmark.RIGHT_EYE,
-                'name': 'Right Eye'
-            },
-            {
-                'value': CatFaceLandmark.MOUTH,
-                'name': 'Mouth'
-            },
-            {
-                'value': CatFaceLandmark.LEFT_OF_LEFT_EAR,
-                'name': 'Left of Left Ear'
-            },
-            {
-                'value': CatFaceLandmark.TIP_OF_LEFT_EAR,
-                'name': 'Tip of Left Ear'
-            },
-            {
-                'value': CatFaceLandmark.RIGHT_OF_LEFT_EAR,
-                'name': 'Right of Left Ear'
-            },
-            {
-                'value': CatFaceLandmark.LEFT_OF_RIGHT_EAR,
-                'name': 'Left of Right Ear'
-            },
-            {
-                'value': CatFaceLandmark.TIP_OF_RIGHT_EAR,
-                'name': 'Tip of Right Ear'
-            },
-            {
-                'value': CatFaceLandmark.RIGHT_OF_RIGHT_EAR,
-                'name': 'Right of Right Ear'
-            }
-        ]
+        return [{'value': value, 'name': name}
+                for value, name in zip(CatFaceLandmark.ORDER,
+                                       CatFaceLandmark.NAMES)]
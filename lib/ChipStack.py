@@ -0,0 +1,57 @@
+import json
+import numpy as np
+import os
+import struct
+
+HEADER_SIZE = 128
+
+
+class ChipStack:
+    """
+    Appends square RGB face chips of a fixed size to a single .npy file. The
+    header is rewritten with the final chip count on close, after which the
+    stack can be opened with np.load(path, mmap_mode='r').
+
+    A JSON Lines index next to the stack, <stem>.jsonl, records the image
+    and face index of every row, since chips are appended in whatever order
+    they are ready.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + '.jsonl'
+        self.size = size
+        self.count = 0
+        self.file = open(path, 'wb')
+        self.file.write(self.__header())
+        self.index = open(self.index_path, 'w')
+
+    def append(self, chip, image=None, face=None):
+        if chip.shape != (self.size, self.size, 3):
+            raise ValueError('expected a {0}x{0}x3 chip, got {1}'.format(
+                self.size, chip.shape))
+
+        self.file.write(np.ascontiguousarray(chip, dtype=np.uint8).data)
+        self.index.write(json.dumps({'row': self.count,
+                                     'image': image,
+                                     'face': face}) + '\n')
+        self.count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.index.close()
+        self.file.seek(0)
+        self.file.write(self.__header())
+        self.file.close()
+
+    def __header(self):
+        header = "{{'descr': '|u1', 'fortran_order': False, " \
+                 "'shape': ({}, {}, {}, 3), }}".format(self.count,
+                                                      self.size,
+                                                      self.size)
+        # magic string, version and header length take up the first 10 bytes
+        header = header.ljust(HEADER_SIZE - 11) + '\n'
+        return (b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) +
+                header.encode('latin1'))
@@ -0,0 +1,198 @@
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import tarfile
+import threading
+import time
+import zipfile
+import numpy as np
+from io import BytesIO
+from lib.CatFaceLandmark import CatFaceLandmark
+from lib.ChipStack import ChipStack
+from lib.ImageWriter import ImageWriter
+
+
+class ChipWriter:
+    """
+    Cuts face chips out of decoded frames and hands their encoding to the
+    shared ImageWriter thread pool. Chips are written as individual JPEG files
+    in output_path, or into a single archive when one is given: a .tar,
+    .tar.gz or .zip of JPEGs, or a .npy stack of raw pixels, which requires a
+    chip size and is indexed by a <stem>.jsonl file. Worker processes each
+    write their own <stem>-<pid> archive.
+
+    With a size, chips are resized to size x size pixels; with align, they
+    are also rotated so that the eyes are level.
+    """
+    _shared = None
+    _lock = threading.Lock()
+
+    def __init__(self,
+                 output_path,
+                 archive=None,
+                 size=None,
+                 align=False,
+                 quality=95):
+        self.output_path = output_path
+        self.size = size
+        self.align = align
+        self.quality = quality
+        self.archive = None
+        self.stack = None
+        self.archive_lock = threading.Lock()
+
+        if archive:
+            archive = ChipWriter.__process_path(archive)
+            directory = os.path.dirname(archive)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            if archive.endswith('.npy'):
+                if not size:
+                    raise ValueError('a .npy chip archive needs a chip size')
+                self.stack = ChipStack(archive, size)
+            elif archive.endswith('.zip'):
+                self.archive = zipfile.ZipFile(archive, 'w')
+            else:
+                gz = archive.endswith(('.gz', '.tgz'))
+                self.archive = tarfile.open(archive, 'w:gz' if gz else 'w')
+
+    @staticmethod
+    def shared(output_path, archive=None, size=None, align=False, quality=95):
+        """Returns the chip writer shared by everything in this process"""
+        with ChipWriter._lock:
+            if ChipWriter._shared is None:
+                ChipWriter._shared = ChipWriter(output_path,
+                                                archive,
+                                                size,
+                                                align,
+                                                quality)
+                # runs before the ImageWriter finalizer so that queued chips
+                # are flushed into the archive before it is closed
+                multiprocessing.util.Finalize(ChipWriter._shared,
+                                              ChipWriter._shared.close,
+                                              exitpriority=20)
+            return ChipWriter._shared
+
+    @staticmethod
+    def close_shared():
+        with ChipWriter._lock:
+            writer, ChipWriter._shared = ChipWriter._shared, None
+        if writer is not None:
+            writer.close()
+
+    def write(self, frame, result, image_name, source=None):
+        """
+        Saves a chip for every face in a DetectorResult, named after a
+        relative image path such as a/cat or a/cat.jpg, e.g. a/cat_face_0.jpg.
+        The .npy index records source, the image as named in the results,
+        or image_name.
+        """
+        stem = os.path.splitext(image_name)[0]
+        if os.path.isabs(stem):
+            stem = os.path.basename(stem)
+        landmarks = result.landmarks
+        if len(landmarks) != result.face_count:
+            landmarks = [None] * result.face_count
+
+        for i, (box, points) in enumerate(zip(result.boxes, landmarks)):
+            chip = self.extract(frame, box, points)
+            if chip.size == 0:
+                continue
+            name = '{}_face_{}.jpg'.format(stem, i)
+
+            if self.stack is not None:
+                # write threads of a pipeline may append at the same time
+                with self.archive_lock:
+                    self.stack.append(chip, source or image_name, i)
+            elif self.archive is not None:
+                ImageWriter.shared().submit(self.__archive,
+                                            name.replace(os.sep, '/'), chip)
+            else:
+                filename = os.path.join(self.output_path, name)
+                os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+                ImageWriter.shared().write(filename, chip, self.quality)
+
+    def extract(self, frame, box, points=None):
+        """
+        Returns the chip for one face box. Without a size or alignment this
+        is a zero-copy view of the frame, unless the box reaches past the
+        frame, whose missing pixels are then padded with black so the chip
+        keeps the size of the box. An empty box gives an empty chip.
+        """
+        if self.align and points is not None:
+            return self.__aligned(frame, box, points)
+
+        chip = ChipWriter.__padded(frame, box)
+        if not self.size or chip.size == 0:
+            return chip
+
+        import cv2
+        return cv2.resize(chip, (self.size, self.size),
+                          interpolation=cv2.INTER_AREA)
+
+    def close(self):
+        ImageWriter.shared().flush()
+        with self.archive_lock:
+            if self.stack is not None:
+                self.stack.close()
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+
+    @staticmethod
+    def __padded(frame, box):
+        left, top, right, bottom = (int(v) for v in box)
+        chip = frame.chip(box)
+        width, height = max(right - left, 0), max(bottom - top, 0)
+        if chip.shape[:2] == (height, width):
+            return chip
+
+        padded = np.zeros((height, width) + chip.shape[2:], dtype=chip.dtype)
+        x, y = max(-left, 0), max(-top, 0)
+        chip = chip[:height - y, :width - x]
+        padded[y:y + chip.shape[0], x:x + chip.shape[1]] = chip
+        return padded
+
+    def __aligned(self, frame, box, points):
+        import cv2
+        left, top, right, bottom = box.tolist()
+        size = self.size or max(right - left, 1)
+        left_eye = points[CatFaceLandmark.LEFT_EYE]
+        right_eye = points[CatFaceLandmark.RIGHT_EYE]
+        angle = math.degrees(math.atan2(right_eye[1] - left_eye[1],
+                                        right_eye[0] - left_eye[0]))
+
+        center = ((left + right) / 2, (top + bottom) / 2)
+        m = cv2.getRotationMatrix2D(center, angle, size / max(right - left, 1))
+        m[0, 2] += size / 2 - center[0]
+        m[1, 2] += size / 2 - center[1]
+        return cv2.warpAffine(frame.data, m, (size, size),
+                              flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REPLICATE)
+
+    def __archive(self, name, chip):
+        data = ImageWriter.encode(chip, '.jpg', self.quality).tobytes()
+        with self.archive_lock:
+            if isinstance(self.archive, zipfile.ZipFile):
+                self.archive.writestr(name, data)
+                return
+
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.archive.addfile(info, BytesIO(data))
+
+    @staticmethod
+    def __process_path(path):
+        """Gives each worker process its own archive next to the requested one"""
+        if multiprocessing.parent_process() is None:
+            return path
+
+        stem, ext = path, ''
+        for suffix in ('.tar.gz', '.tgz', '.tar', '.zip', '.npy'):
+            if path.endswith(suffix):
+                stem, ext = path[:-len(suffix)], suffix
+                break
+        return '{}-{}{}'.format(stem, os.getpid(), ext)
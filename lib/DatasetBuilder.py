@@ -0,0 +1,139 @@
+import itertools
+import numpy as np
+import os
+import xml.etree.ElementTree as et
+import zlib
+from lib.CatFace import CatFace
+from lib.CatFaceLandmark import CatFaceLandmark
+from lib.ImageScanner import ImageScanner
+
+SPLITS = ('train', 'validation', 'test')
+
+HEADER = '''<?xml version='1.0' encoding='utf-8'?>
+<?xml-stylesheet type='text/xsl' href='image_metadata_stylesheet.xsl'?>
+<dataset>
+<name>imglab dataset</name>
+<comment>Created by imglab tool.</comment>
+<images>
+'''
+FOOTER = '''</images>
+</dataset>
+'''
+
+
+class DatasetBuilder:
+    """
+    Builds imglab XML datasets from a folder of images and their .cat
+    annotations. Annotations are parsed in chunks across a pool of worker
+    processes and every image is written out as soon as its chunk is done,
+    so memory use does not grow with the size of the dataset. Images are
+    split into training, validation and testing sets by a hash of their
+    path, so the same folder always gives the same split.
+    """
+
+    def __init__(self,
+                 folder,
+                 split=(0.8, 0.1, 0.1),
+                 workers=1,
+                 chunk_size=256,
+                 recursive=True):
+        if len(split) != len(SPLITS) or min(split) < 0 or sum(split) <= 0:
+            raise ValueError('split must be three non-negative fractions')
+
+        self.folder = folder
+        self.bounds = np.cumsum(split) / sum(split)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.recursive = recursive
+
+    def images(self):
+        """Lazily yields the images in the folder that have a .cat file"""
+        for image in ImageScanner(self.folder, self.recursive):
+            if os.path.isfile(image + '.cat'):
+                yield image
+
+    def build(self, outputs):
+        """
+        Writes each split to the XML file given for it in outputs, a dict
+        keyed by 'train', 'validation' and 'test', and returns the number of
+        images written to each
+        """
+        counts = dict.fromkeys(SPLITS, 0)
+        folders = {name: os.path.dirname(os.path.abspath(outputs[name]))
+                   for name in SPLITS}
+        files = {}
+        try:
+            for name in SPLITS:
+                files[name] = open(outputs[name], 'w', encoding='utf-8')
+                files[name].write(HEADER)
+
+            for images, boxes, points in self.__parse_all():
+                for image, box, landmarks in zip(images, boxes, points):
+                    name = self.split_of(image)
+                    element = CatFace.element(
+                        os.path.relpath(image, folders[name]),
+                        dict(zip(('left', 'top', 'width', 'height'), box)),
+                        landmarks)
+                    files[name].write(et.tostring(element, encoding='unicode'))
+                    files[name].write('\n')
+                    counts[name] += 1
+
+            for f in files.values():
+                f.write(FOOTER)
+        finally:
+            for f in files.values():
+                f.close()
+
+        return counts
+
+    def split_of(self, image):
+        """Picks the split an image belongs to from a hash of its path"""
+        name = os.path.relpath(image, self.folder).replace(os.sep, '/')
+        position = zlib.crc32(name.encode('utf-8')) % 10000 / 10000
+        return SPLITS[min(int(np.searchsorted(self.bounds, position, 'right')),
+                          len(SPLITS) - 1)]
+
+    def __parse_all(self):
+        images = self.images()
+        chunks = iter(lambda: list(itertools.islice(images, self.chunk_size)),
+                      [])
+
+        if self.workers <= 1:
+            yield from map(DatasetBuilder.parse, chunks)
+            return
+
+        from lib.WorkerPool import WorkerPool
+        with WorkerPool(self.workers, None, None) as pool:
+            yield from pool.map(DatasetBuilder.parse, chunks)
+
+    @staticmethod
+    def parse(images):
+        """
+        Reads the .cat annotation of each image and returns the images that
+        were parsed along with their Nx4 left, top, width, height boxes and
+        their Nx9x2 landmark points. Malformed annotations are skipped.
+        """
+        parsed = []
+        values = []
+        for image in images:
+            with open(image + '.cat') as f:
+                fields = f.read().split()
+            if len(fields) != 1 + 2 * CatFaceLandmark.COUNT \
+                    or fields[0] != str(CatFaceLandmark.COUNT):
+                continue
+            try:
+                values.append(np.array(fields[1:], dtype=np.int32))
+            except ValueError:
+                continue
+            parsed.append(image)
+
+        points = np.array(values, dtype=np.int32).reshape(
+            -1, CatFaceLandmark.COUNT, 2)
+        return parsed, DatasetBuilder.boxes(points), points
+
+    @staticmethod
+    def boxes(points):
+        """Computes the square box around the landmarks of each face"""
+        low = points.min(axis=1)
+        size = (points.max(axis=1) - low).max(axis=1)
+        return np.column_stack((low, size, size))
@@ -0,0 +1,210 @@
+import concurrent.futures
+import http.server
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from lib.Trainer import DETECTOR_SVM
+from lib.Trainer import PREDICTOR_DAT
+from lib.WorkerPool import WorkerPool
+
+
+class DetectionServer:
+    """
+    Long-lived HTTP detection service that keeps the models warm in a pool of
+    worker processes. Images POSTed to /detect are queued and grouped into
+    micro-batches for up to batch_window seconds before being handed to the
+    pool. Requests are rejected with 503 once max_queue images are waiting,
+    and /metrics exposes Prometheus counters.
+
+    process is called in the workers with a list of encoded images and must
+    return one result, or the exception raised for it, per image. The
+    workers preload detector_svm, a path or list of paths, and
+    predictor_dat.
+    """
+
+    def __init__(self,
+                 process,
+                 workers=1,
+                 batch_window=0.005,
+                 max_batch=16,
+                 max_queue=256,
+                 timeout=30,
+                 detector_svm=DETECTOR_SVM,
+                 predictor_dat=PREDICTOR_DAT):
+        self.process = process
+        self.detector_svm = detector_svm
+        self.predictor_dat = predictor_dat
+        self.workers = max(1, workers)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.requests = queue.Queue(max_queue)
+        self.batches = threading.BoundedSemaphore(self.workers * 2)
+        self.metrics = {
+            'catfd_requests_total': 0,
+            'catfd_rejected_total': 0,
+            'catfd_errors_total': 0,
+            'catfd_batches_total': 0,
+            'catfd_batched_images_total': 0,
+            'catfd_request_seconds_total': 0.0,
+        }
+        self.metrics_lock = threading.Lock()
+        self.pool = None
+        self.httpd = None
+
+    def serve(self, host='127.0.0.1', port=8080, unix_socket=None):
+        """Serves on host:port, or on unix_socket when given, until stopped"""
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            self.httpd = UnixHTTPServer(unix_socket, self.__handler())
+        else:
+            self.httpd = http.server.ThreadingHTTPServer((host, port),
+                                                         self.__handler())
+
+        with WorkerPool(self.workers,
+                        self.detector_svm,
+                        self.predictor_dat) as self.pool:
+            batcher = threading.Thread(target=self.__batch, daemon=True)
+            batcher.start()
+            try:
+                self.httpd.serve_forever()
+            finally:
+                self.httpd.server_close()
+
+    def shutdown(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+
+    def detect(self, data):
+        """Queues one encoded image and waits for its result"""
+        future = concurrent.futures.Future()
+        try:
+            self.requests.put_nowait((data, future))
+        except queue.Full:
+            self.count('catfd_rejected_total')
+            return None
+
+        return future.result(self.timeout)
+
+    def render_metrics(self):
+        with self.metrics_lock:
+            metrics = dict(self.metrics)
+
+        metrics['catfd_queue_depth'] = self.requests.qsize()
+        lines = []
+        for name, value in metrics.items():
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines.append('# TYPE {} {}\n{} {}\n'.format(name, kind, name, value))
+        return ''.join(lines)
+
+    def __batch(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batches.acquire()
+            self.count('catfd_batches_total')
+            self.count('catfd_batched_images_total', len(batch))
+            future = self.pool.submit(self.process, [b[0] for b in batch])
+            future.add_done_callback(
+                lambda f, batch=batch: self.__resolve(f, batch))
+
+    def __resolve(self, future, batch):
+        self.batches.release()
+        try:
+            results = future.result()
+        except Exception as e:
+            for _, waiter in batch:
+                waiter.set_exception(e)
+            return
+
+        for (_, waiter), result in zip(batch, results):
+            if isinstance(result, Exception):
+                waiter.set_exception(result)
+            else:
+                waiter.set_result(result)
+
+    def count(self, metric, value=1):
+        with self.metrics_lock:
+            self.metrics[metric] += value
+
+    def __handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    self.__reply(200, server.render_metrics(), 'text/plain')
+                elif self.path == '/health':
+                    self.__reply(200, 'ok\n', 'text/plain')
+                else:
+                    self.__reply(404, 'not found\n', 'text/plain')
+
+            def do_POST(self):
+                if self.path != '/detect':
+                    self.__reply(404, 'not found\n', 'text/plain')
+                    return
+
+                start = time.perf_counter()
+                server.count('catfd_requests_total')
+                length = int(self.headers.get('Content-Length', 0))
+                data = self.rfile.read(length)
+
+                try:
+                    faces = server.detect(data)
+                except concurrent.futures.TimeoutError:
+                    self.__reply(504, 'timed out\n', 'text/plain')
+                    return
+                except Exception as e:
+                    server.count('catfd_errors_total')
+                    self.__reply(400, '{}\n'.format(e), 'text/plain')
+                    return
+
+                if faces is None:
+                    self.__reply(503, 'busy\n', 'text/plain')
+                    return
+
+                server.count(
+                    'catfd_request_seconds_total',
+                    time.perf_counter() - start)
+                self.__reply(200,
+                             json.dumps({'faces': faces}),
+                             'application/json')
+
+            def __reply(self, status, body, content_type):
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class UnixHTTPServer(http.server.ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        self.socket.bind(self.server_address)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('unix', 0)
@@ -1,18 +1,367 @@
 import dlib
+import functools
+import numpy as np
+from .BatchResult import BatchResult
 from .DetectorResult import DetectorResult
+from lib.Instrumentation import Instrumentation
+from lib.ModelRegistry import ModelRegistry
 from lib.Trainer import DETECTOR_SVM
 from lib.Trainer import PREDICTOR_DAT
-from skimage import io
 
 
 class Detector:
-    def __init__(self, input_image):
-        self.input_image = input_image
-        self.image_data = io.imread(input_image)
-        self.detector = dlib.fhog_object_detector(DETECTOR_SVM)
-        self.predictor = dlib.shape_predictor(PREDICTOR_DAT)
+    """
+    Runs the FHOG detector and shape predictor on decoded images. The models
+    are shared through the ModelRegistry, so a single Detector can be reused
+    for any number of images.
+
+    Images larger than max_size pixels on their longest side are downscaled
+    before the detector scans them, and the boxes are mapped back to the
+    original resolution so landmarks are predicted on the full pixels.
+
+    Images larger than tile_size are scanned in overlapping tiles, so the
+    detector's image pyramid is bounded by the tile size rather than the
+    image size. With tile_workers > 1 the tiles are scanned in a pool of
+    processes. Boxes found twice where tiles overlap are merged with
+    non-maximum suppression.
+    """
+
+    def __init__(self,
+                 detector_svm=DETECTOR_SVM,
+                 predictor_dat=PREDICTOR_DAT,
+                 upsample=1,
+                 max_size=None,
+                 tile_size=None,
+                 tile_overlap=None,
+                 tile_workers=1):
+        # detector_svm may also be a list of models, e.g. rotated or profile
+        # variants, which are all run on the same HOG pyramid
+        if isinstance(detector_svm, str):
+            detector_svm = [detector_svm]
+        self.detector_svms = list(detector_svm)
+        self.detector_svm = self.detector_svms[0]
+        self.predictor_dat = predictor_dat
+        self.upsample = upsample
+        self.max_size = max_size
+        self.tile_size = tile_size
+        self.tile_overlap = tile_size // 4 if tile_overlap is None \
+            and tile_size else tile_overlap
+        self.tile_workers = tile_workers
         self.result = DetectorResult()
+        self.__tile_pool = None
+
+    @property
+    def detector(self):
+        return ModelRegistry.detector(self.detector_svm)
+
+    @property
+    def detectors(self):
+        return [ModelRegistry.detector(path) for path in self.detector_svms]
+
+    @property
+    def predictor(self):
+        return ModelRegistry.predictor(self.predictor_dat)
+
+    @property
+    def version(self):
+        """Identifies the models and settings that produce this detector's results"""
+        version = '{}:{}:{}:{}'.format(
+            '+'.join(ModelRegistry.digest(path)
+                     for path in self.detector_svms),
+            ModelRegistry.digest(self.predictor_dat),
+            self.upsample,
+            self.max_size)
+        if self.tile_size:
+            version += ':{}/{}'.format(self.tile_size, self.tile_overlap)
+        return version
+
+    def close(self):
+        """Shuts down the tile worker processes, if any were started"""
+        if self.__tile_pool is not None:
+            self.__tile_pool.close()
+            self.__tile_pool = None
+
+    def detect(self, image_data, predict=True):
+        """
+        Finds the faces in an image and, unless predict is False, their
+        landmarks
+        """
+        boxes, scores, models = self.find_scored_faces(image_data)
+        faces = Detector.__rectangles(boxes)
+        shapes = self.predict(image_data, faces) if predict else ()
+        self.result = self.__result(faces, shapes, scores, models)
+        return self.result
+
+    def detect_frame(self, frame, predict=True):
+        """
+        Like detect, but takes a Frame that may have been decoded at reduced
+        resolution. The boxes are mapped back to the source resolution, and
+        the full resolution image is only decoded when there are landmarks
+        to predict.
+        """
+        timings = Instrumentation.current()
+        with timings.stage('detect'):
+            boxes, scores, models = self.find_scored_faces(frame.data)
+            faces = Detector.__rectangles(
+                Detector.__scale_boxes(boxes, 1 / frame.scale))
+
+        shapes = ()
+        if predict and len(faces):
+            with timings.stage('decode'):
+                full = frame.full()
+            with timings.stage('predict'):
+                shapes = self.predict(full.data, faces)
+
+        self.result = self.__result(faces, shapes, scores, models)
+        return self.result
+
+    def landmark(self, image_data, boxes):
+        """
+        Predicts the landmarks of faces whose Nx4 (left, top, right, bottom)
+        boxes were found elsewhere, e.g. by an upstream detector or a
+        previous run, without running the detector
+        """
+        faces = Detector.__rectangles(
+            np.asarray(boxes, dtype=np.int64).reshape(-1, 4))
+        self.result = DetectorResult.from_dlib(faces,
+                                               self.predict(image_data, faces))
+        return self.result
+
+    def landmark_batch(self, images, boxes, image_index):
+        """
+        Like landmark, but for a batch of decoded images, with the Nx4 boxes
+        of all faces and the position of each face's image in the batch, as
+        held by a BatchResult. Returns a BatchResult with the faces grouped by
+        image.
+        """
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        image_index = np.asarray(image_index, dtype=np.int32)
+        order = np.argsort(image_index, kind='stable')
+        boxes = boxes[order]
+        image_index = image_index[order]
+        bounds = np.searchsorted(image_index,
+                                 np.arange(len(images) + 1)).tolist()
+
+        landmarks = []
+        for i, image in enumerate(images):
+            result = self.landmark(image, boxes[bounds[i]:bounds[i + 1]])
+            landmarks.extend(result.landmarks)
+        return BatchResult(boxes[:bounds[-1]], landmarks,
+                           image_index[:bounds[-1]], len(images))
+
+    def find_frame_faces(self, frame):
+        """Returns the face rectangles of a Frame in source coordinates"""
+        boxes, _, _ = self.find_scored_faces(frame.data)
+        return Detector.__rectangles(
+            Detector.__scale_boxes(boxes, 1 / frame.scale))
+
+    def predict(self, image_data, faces):
+        """Runs the shape predictor on each face rectangle"""
+        predictor = self.predictor
+        return [predictor(image_data, face) for face in faces]
+
+    def find_faces(self, image_data, upsample=None, detector=None):
+        """Returns the face rectangles in full resolution image coordinates"""
+        boxes, _, _ = self.find_scored_faces(
+            image_data, upsample, None if detector is None else [detector])
+        return Detector.__rectangles(boxes)
+
+    def find_scored_faces(self, image_data, upsample=None, detectors=None):
+        """
+        Returns the Nx4 (left, top, right, bottom) face boxes in full
+        resolution image coordinates, their detection scores, and the index
+        in detector_svms of the model that found each face. With several
+        models, the boxes they agree on are merged with non-maximum
+        suppression.
+        """
+        if upsample is None:
+            upsample = self.upsample
+        if detectors is None:
+            detectors = self.detectors
+
+        height, width = image_data.shape[:2]
+        if not self.max_size or max(height, width) <= self.max_size:
+            return self.__scan(image_data, upsample, detectors)
+
+        import cv2
+        scale = self.max_size / max(height, width)
+        small = cv2.resize(image_data,
+                           (max(1, round(width * scale)),
+                            max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+        boxes, scores, models = self.__scan(small, upsample, detectors)
+        return Detector.__scale_boxes(boxes, 1 / scale), scores, models
+
+    def __result(self, faces, shapes, scores, models):
+        # faces are only tagged with their score and model when there is a
+        # choice of models
+        if len(self.detector_svms) == 1:
+            return DetectorResult.from_dlib(faces, shapes)
+        return DetectorResult.from_dlib(faces, shapes, scores, models)
+
+    @staticmethod
+    def __rectangles(boxes):
+        faces = dlib.rectangles()
+        for left, top, right, bottom in boxes.tolist():
+            faces.append(dlib.rectangle(left, top, right, bottom))
+        return faces
+
+    @staticmethod
+    def __scale_boxes(boxes, scale):
+        if scale == 1:
+            return boxes
+        return np.round(boxes * scale).astype(np.int64)
+
+    def __scan(self, image_data, upsample, detectors):
+        height, width = image_data.shape[:2]
+        if not self.tile_size or max(height, width) <= self.tile_size:
+            boxes, scores, models = Detector.scan_tile(
+                image_data, upsample=upsample, detectors=detectors)
+            if len(detectors) == 1:
+                return boxes, scores, models
+            keep = Detector.suppress(boxes, scores)
+            return boxes[keep], scores[keep], models[keep]
+
+        tiles = Detector.tiles(width, height, self.tile_size,
+                               self.tile_overlap)
+        # dlib misreads strided views, so each tile is copied into a
+        # contiguous array, which keeps memory bounded by the tile size
+        crops = (np.ascontiguousarray(image_data[top:bottom, left:right])
+                 for left, top, right, bottom in tiles)
+        if self.tile_workers > 1:
+            if self.__tile_pool is None:
+                from lib.WorkerPool import WorkerPool
+                self.__tile_pool = WorkerPool(self.tile_workers,
+                                              self.detector_svms,
+                                              None)
+            found = self.__tile_pool.map(
+                functools.partial(Detector.scan_tile,
+                                  detector_svms=self.detector_svms,
+                                  upsample=upsample),
+                crops)
+        else:
+            found = (Detector.scan_tile(crop, upsample=upsample,
+                                        detectors=detectors)
+                     for crop in crops)
+
+        boxes = []
+        scores = []
+        models = []
+        for (left, top, _, _), (tile_boxes, tile_scores, tile_models) \
+                in zip(tiles, found):
+            boxes.append(tile_boxes + (left, top, left, top))
+            scores.append(tile_scores)
+            models.append(tile_models)
+        boxes = np.concatenate(boxes)
+        scores = np.concatenate(scores)
+        models = np.concatenate(models)
+        keep = Detector.suppress(boxes, scores)
+        return boxes[keep], scores[keep], models[keep]
+
+    @staticmethod
+    def tiles(width, height, tile_size, overlap):
+        """
+        Returns the (left, top, right, bottom) tiles of at most tile_size
+        pixels, overlapping by overlap pixels, that cover an image
+        """
+        step = max(tile_size - overlap, 1)
+
+        def starts(length):
+            last = max(length - tile_size, 0)
+            positions = list(range(0, last + 1, step))
+            if positions[-1] != last:
+                positions.append(last)
+            return positions
+
+        return [(left, top,
+                 min(left + tile_size, width), min(top + tile_size, height))
+                for top in starts(height) for left in starts(width)]
+
+    @staticmethod
+    def scan_tile(tile, detector_svms=(DETECTOR_SVM,), upsample=1,
+                  detectors=None):
+        """
+        Returns the Nx4 boxes, N scores and N model indices that the
+        detectors find in one image or tile. Several detectors are evaluated
+        together by dlib, which computes the HOG pyramid only once for all of
+        them. In worker processes the detectors come from the ModelRegistry.
+        """
+        if detectors is None:
+            detectors = [ModelRegistry.detector(path)
+                         for path in detector_svms]
+        if len(detectors) == 1:
+            faces, scores, _ = detectors[0].run(tile, upsample, 0.0)
+            models = np.zeros(len(faces), dtype=np.int32)
+        else:
+            faces, scores, models = dlib.fhog_object_detector.run_multiple(
+                detectors, tile, upsample, 0.0)
+        boxes = np.array([(f.left(), f.top(), f.right(), f.bottom())
+                          for f in faces], dtype=np.int64).reshape(-1, 4)
+        return (boxes,
+                np.array(scores, dtype=np.float64),
+                np.array(models, dtype=np.int32))
+
+    @staticmethod
+    def suppress(boxes, scores, iou_threshold=0.5, cover_threshold=0.8):
+        """
+        Greedy non-maximum suppression. Returns the indices of the boxes to
+        keep, best first, dropping any box that overlaps a better one by more
+        than iou_threshold, or that is mostly covered by it as happens to
+        faces cut off at a tile edge.
+        """
+        left, top, right, bottom = boxes.T
+        areas = (right - left + 1) * (bottom - top + 1)
+        order = np.argsort(-scores, kind='stable')
+        keep = []
+
+        while len(order):
+            best, rest = order[0], order[1:]
+            keep.append(best)
+            width = np.minimum(right[best], right[rest]) - \
+                np.maximum(left[best], left[rest]) + 1
+            height = np.minimum(bottom[best], bottom[rest]) - \
+                np.maximum(top[best], top[rest]) + 1
+            overlap = np.clip(width, 0, None) * np.clip(height, 0, None)
+            iou = overlap / (areas[best] + areas[rest] - overlap)
+            cover = overlap / np.minimum(areas[best], areas[rest])
+            order = rest[(iou <= iou_threshold) & (cover <= cover_threshold)]
+
+        return np.array(keep, dtype=np.int64)
+
+    def detect_batch(self, images, upsample=None):
+        """
+        Detects faces and predicts their landmarks in every image of an
+        iterable of decoded images, returning a single BatchResult. dlib's
+        FHOG detector has no multi-image entry point, so each image is still
+        scanned with its own call, but the models are resolved once and no
+        per-face Python objects outlive the batch.
+        """
+        if upsample is None:
+            upsample = self.upsample
+
+        detectors = self.detectors
+        predictor = self.predictor
+        boxes = []
+        landmarks = []
+        scores = []
+        models = []
+        image_index = []
+        count = 0
+
+        for i, image in enumerate(images):
+            count += 1
+            found, found_scores, found_models = self.find_scored_faces(
+                image, upsample, detectors)
+            for face in Detector.__rectangles(found):
+                shape = predictor(image, face)
+                landmarks.append([(p.x, p.y) for p in shape.parts()])
+            boxes.extend(found.tolist())
+            scores.extend(found_scores.tolist())
+            models.extend(found_models.tolist())
+            image_index.extend([i] * len(found))
 
-    def detect(self):
-        self.result.faces = self.detector(self.image_data, 1)
-        self.result.face_count = len(self.result.faces)
+        if len(self.detector_svms) == 1:
+            scores = models = None
+        return BatchResult(boxes, landmarks, image_index, count, scores,
+                           models)
@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import time
+import xml.etree.ElementTree as et
+from lib.Detector import Detector
+from lib.Frame import Frame
+
+
+class DetectorBenchmark:
+    """
+    Measures detection speed against recall and precision on an imglab XML
+    dataset for different upsample and max_size settings
+    """
+
+    def __init__(self, xml, iou_threshold=0.5):
+        self.xml = xml
+        self.iou_threshold = iou_threshold
+        self.images = DetectorBenchmark.load_boxes(xml)
+
+    @staticmethod
+    def load_boxes(xml):
+        """Reads (image path, Nx4 truth boxes) pairs from an imglab XML file"""
+        folder = os.path.dirname(xml)
+        images = []
+        for image in et.parse(xml).getroot().iter('image'):
+            boxes = []
+            for box in image.iter('box'):
+                if box.get('ignore') == '1':
+                    continue
+                left = int(box.get('left'))
+                top = int(box.get('top'))
+                boxes.append((left,
+                              top,
+                              left + int(box.get('width')),
+                              top + int(box.get('height'))))
+            images.append((os.path.join(folder, image.get('file')),
+                           np.array(boxes, dtype=np.int32).reshape(-1, 4)))
+        return images
+
+    def run(self, upsample, max_size=None):
+        d = Detector(upsample=upsample, max_size=max_size)
+        elapsed = 0.0
+        truth = found = matched = 0
+
+        for filename, boxes in self.images:
+            image_data = Frame.load(filename).data
+            start = time.perf_counter()
+            faces = d.find_faces(image_data)
+            elapsed += time.perf_counter() - start
+
+            detections = np.array([(f.left(), f.top(), f.right(), f.bottom())
+                                   for f in faces]).reshape(-1, 4)
+            matched += DetectorBenchmark.match(boxes,
+                                               detections,
+                                               self.iou_threshold)
+            truth += len(boxes)
+            found += len(detections)
+
+        return {
+            'upsample': upsample,
+            'max_size': max_size,
+            'images': len(self.images),
+            'seconds': elapsed,
+            'images_per_second': len(self.images) / elapsed if elapsed else 0,
+            'recall': matched / truth if truth else 0,
+            'precision': matched / found if found else 0,
+        }
+
+    def sweep(self, upsamples, max_sizes):
+        for max_size in max_sizes:
+            for upsample in upsamples:
+                yield self.run(upsample, max_size)
+
+    @staticmethod
+    def iou(a, b):
+        """Intersection over union of every box in a with every box in b"""
+        a = a[:, None, :].astype(np.float64)
+        b = b[None, :, :].astype(np.float64)
+        w = np.clip(np.minimum(a[..., 2], b[..., 2]) -
+                    np.maximum(a[..., 0], b[..., 0]), 0, None)
+        h = np.clip(np.minimum(a[..., 3], b[..., 3]) -
+                    np.maximum(a[..., 1], b[..., 1]), 0, None)
+        inter = w * h
+        area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+        area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+        return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+    @staticmethod
+    def match(truth, detections, threshold):
+        """Greedily counts detections that overlap a distinct truth box"""
+        if len(truth) == 0 or len(detections) == 0:
+            return 0
+
+        overlap = DetectorBenchmark.iou(truth, detections)
+        matched = 0
+        while True:
+            i, j = np.unravel_index(np.argmax(overlap), overlap.shape)
+            if overlap[i, j] < threshold:
+                return matched
+            matched += 1
+            overlap[i, :] = 0
+            overlap[:, j] = 0
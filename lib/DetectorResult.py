@@ -1,5 +1,140 @@
+import numpy as np
+from lib.CatFaceLandmark import CatFaceLandmark
+
+RECORD_DTYPE = np.dtype([('box', '<i4', (4,)),
+                         ('landmarks', '<i4', (CatFaceLandmark.COUNT, 2))])
+
+
 class DetectorResult:
-    face_count = 0
+    """
+    Faces found in an image, stored as arrays instead of dlib objects. boxes
+    is an Nx4 int32 array of (left, top, right, bottom) and landmarks is an
+    Nx9x2 int32 array of (x, y) points in shape predictor part order, empty
+    when landmarks were not predicted. When several detector models were
+    run, scores holds each face's detection score and models the index of
+    the model that found it; otherwise both are None.
+    """
+    __slots__ = ('boxes', 'landmarks', 'scores', 'models')
+
+    def __init__(self, boxes=(), landmarks=(), scores=None, models=None):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.landmarks = np.asarray(landmarks, dtype=np.int32).reshape(
+            -1, CatFaceLandmark.COUNT, 2)
+        self.scores = None if scores is None \
+            else np.asarray(scores, dtype=np.float32)
+        self.models = None if models is None \
+            else np.asarray(models, dtype=np.int32)
+
+    @staticmethod
+    def from_dlib(faces, shapes=(), scores=None, models=None):
+        """Converts dlib rectangles and full_object_detections"""
+        return DetectorResult(
+            [(f.left(), f.top(), f.right(), f.bottom()) for f in faces],
+            [[(p.x, p.y) for p in shape.parts()] for shape in shapes],
+            scores,
+            models)
+
+    @staticmethod
+    def from_json(faces):
+        """Rebuilds a result from the faces returned by to_json"""
+        boxes = [[face['face'][key]
+                  for key in ('left', 'top', 'right', 'bottom')]
+                 for face in faces]
+        landmarks = ()
+        if all(face['face']['landmarks'] for face in faces):
+            landmarks = np.zeros((len(faces), CatFaceLandmark.COUNT, 2),
+                                 dtype=np.int32)
+            for points, face in zip(landmarks, faces):
+                points[list(CatFaceLandmark.ORDER)] = [
+                    face['face']['landmarks'][name]
+                    for name in CatFaceLandmark.NAMES]
+
+        if faces and 'confidence' in faces[0]['face']:
+            return DetectorResult(boxes, landmarks,
+                                  [face['face']['confidence']
+                                   for face in faces],
+                                  [face['face']['model'] for face in faces])
+        return DetectorResult(boxes, landmarks)
+
+    @staticmethod
+    def from_records(records):
+        return DetectorResult(records['box'], records['landmarks'])
+
+    @staticmethod
+    def from_npy(file):
+        return DetectorResult.from_records(np.load(file))
+
+    @property
+    def face_count(self):
+        return len(self.boxes)
+
+    @property
+    def widths(self):
+        return self.boxes[:, 2] - self.boxes[:, 0]
+
+    @property
+    def heights(self):
+        return self.boxes[:, 3] - self.boxes[:, 1]
+
+    def landmark(self, value):
+        """Returns the Nx2 points of one landmark, e.g. CatFaceLandmark.MOUTH"""
+        return self.landmarks[:, value]
+
+    def rects(self):
+        """Returns the boxes as dlib rectangles, e.g. for the shape predictor"""
+        import dlib
+        return dlib.rectangles([dlib.rectangle(*box)
+                                for box in self.boxes.tolist()])
+
+    def to_json(self):
+        """Returns the faces in the JSON schema printed by catfd.py"""
+        boxes = self.boxes.tolist()
+        if len(self.landmarks) == len(boxes):
+            points = self.landmarks[:, CatFaceLandmark.ORDER].tolist()
+        else:
+            points = [()] * len(boxes)
+
+        faces = []
+        for (left, top, right, bottom), p in zip(boxes, points):
+            faces.append({
+                'face': {
+                    'left': left,
+                    'top': top,
+                    'right': right,
+                    'bottom': bottom,
+                    'height': bottom - top,
+                    'width': right - left,
+                    'landmarks': dict(zip(CatFaceLandmark.NAMES, p))
+                }
+            })
+
+        if self.scores is not None:
+            for face, score, model in zip(faces,
+                                          self.scores.tolist(),
+                                          self.models.tolist()):
+                face['face']['confidence'] = round(score, 4)
+                face['face']['model'] = model
+        return faces
+
+    def to_records(self):
+        """Returns the faces as a structured array of RECORD_DTYPE"""
+        records = np.zeros(self.face_count, dtype=RECORD_DTYPE)
+        records['box'] = self.boxes
+        if len(self.landmarks) == self.face_count:
+            records['landmarks'] = self.landmarks
+        return records
+
+    def to_npy(self, file):
+        np.save(file, self.to_records())
 
-    def __init__(self):
-        pass
+    def to_msgpack(self):
+        """
+        Packs the face count and the raw little-endian int32 box and landmark
+        arrays with msgpack, which must be installed separately
+        """
+        import msgpack
+        return msgpack.packb({
+            'count': self.face_count,
+            'boxes': self.boxes.astype('<i4').tobytes(),
+            'landmarks': self.landmarks.astype('<i4').tobytes(),
+        })
@@ -0,0 +1,91 @@
+import math
+import mmap
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+
+class Frame:
+    """
+    Holds a single decoded image so that detection, landmark prediction, chip
+    cropping and annotation all share the same pixels instead of decoding the
+    source file again
+
+    When loaded with a max_size, JPEGs are decoded with libjpeg DCT scaling
+    straight to the smallest size of at least max_size pixels on the longest
+    side. scale is then the ratio of decoded to source pixels, and full()
+    decodes the full resolution image on demand from the same memory-mapped
+    input.
+    """
+
+    def __init__(self, data, source=None, scale=1.0, buffer=None):
+        self.data = data
+        self.source = source
+        self.scale = scale
+        self.__buffer = buffer
+        self.__full = None
+
+    @staticmethod
+    def load(filename, max_size=None):
+        with open(filename, 'rb') as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped, let the decoder reject them
+                buffer = BytesIO(f.read())
+        return Frame.__decode(buffer, filename, max_size)
+
+    @staticmethod
+    def from_bytes(data, source=None, max_size=None):
+        """Decodes an encoded image held in memory"""
+        return Frame.__decode(BytesIO(data), source, max_size)
+
+    @staticmethod
+    def __decode(buffer, source, max_size):
+        buffer.seek(0)
+        with Image.open(buffer) as image:
+            width = image.size[0]
+            longest = max(image.size)
+            if max_size and longest > max_size:
+                scale = max_size / longest
+                image.draft('RGB', (math.ceil(image.size[0] * scale),
+                                    math.ceil(image.size[1] * scale)))
+            data = Frame.__rgb(image)
+
+        scale = data.shape[1] / width
+        if scale == 1:
+            return Frame(data, source)
+        return Frame(data, source, scale, buffer)
+
+    @staticmethod
+    def __rgb(image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    def full(self):
+        """Returns this frame at the full resolution of its source"""
+        if self.scale == 1:
+            return self
+        if self.__full is None:
+            self.__full = Frame.__decode(self.__buffer, self.source, None)
+        return self.__full
+
+    def chip(self, box):
+        """
+        Returns a zero-copy view of the frame inside a (left, top, right,
+        bottom) face box
+        """
+        left, top, right, bottom = (max(int(v), 0) for v in box)
+        return self.data[top:bottom, left:right]
+
+    def copy(self):
+        return Frame(self.data.copy(), self.source)
@@ -0,0 +1,58 @@
+import os
+import zlib
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp']
+
+
+class ImageScanner:
+    """
+    Lazily yields the image files in a folder using os.scandir, optionally
+    recursing into subfolders and keeping only one shard of the files. Only
+    the list of folders still to visit is held in memory.
+    """
+
+    def __init__(self,
+                 folder,
+                 recursive=False,
+                 extensions=IMAGE_EXTENSIONS,
+                 shard=None):
+        self.folder = folder
+        self.recursive = recursive
+        self.extensions = {'.' + e.lower().lstrip('.') for e in extensions}
+        self.shard = shard
+
+    def __iter__(self):
+        folders = [self.folder]
+        while folders:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if self.recursive:
+                            folders.append(entry.path)
+                    elif self.__accepts(entry):
+                        yield entry.path
+
+    def __accepts(self, entry):
+        ext = os.path.splitext(entry.name)[1].lower()
+        if ext not in self.extensions or not entry.is_file():
+            return False
+
+        if self.shard is None:
+            return True
+
+        index, count = self.shard
+        name = os.path.relpath(entry.path, self.folder)
+        return zlib.crc32(name.encode('utf-8')) % count == index
+
+    @staticmethod
+    def parse_shard(value):
+        """Parses a shard given as 'i/n' into an (i, n) tuple"""
+        try:
+            index, count = (int(v) for v in value.split('/'))
+        except ValueError:
+            raise ValueError("shard must look like i/n, got '%s'" % value)
+
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("shard index must be in [0, n), got '%s'" % value)
+
+        return index, count
@@ -0,0 +1,192 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as et
+from io import BytesIO
+from PIL import Image
+from lib.DatasetBuilder import FOOTER
+from lib.DatasetBuilder import HEADER
+from lib.Frame import Frame
+from lib.ImageWriter import ImageWriter
+
+MANIFEST = 'manifest.json'
+
+
+class ImageStore:
+    """
+    Content-addressed cache of training images resized to at most max_size
+    pixels on their longest side. A manifest records the size, mtime, key
+    and scale of every source image, so only new or changed images are
+    decoded and resized again, and a resized copy is shared by every source
+    with the same contents.
+    """
+
+    def __init__(self, folder, max_size=1024, quality=95, workers=1):
+        self.folder = folder
+        self.max_size = max_size
+        self.quality = quality
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+        try:
+            with open(os.path.join(folder, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def path(self, key):
+        return ImageStore.cached_path(self.folder, key)
+
+    def lookup(self, image):
+        """Returns the manifest entry of an image if it is still current"""
+        entry = self.manifest.get(image)
+        if entry is None or entry['max_size'] != self.max_size:
+            return None
+
+        stat = os.stat(image)
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime \
+                or not os.path.isfile(self.path(entry['key'])):
+            return None
+
+        self.hits += 1
+        return entry
+
+    def resize_dataset(self, source_xml, output_xml):
+        """
+        Writes a copy of an imglab XML file whose images point into the
+        store and whose boxes and landmarks are scaled to match, resizing
+        images that are not in the store yet
+        """
+        source_folder = os.path.dirname(os.path.abspath(source_xml))
+        output_folder = os.path.dirname(os.path.abspath(output_xml))
+        resize = functools.partial(ImageStore.resize,
+                                   folder=self.folder,
+                                   max_size=self.max_size,
+                                   quality=self.quality)
+        pending = collections.deque()
+
+        def images():
+            for image in ImageStore.__images(source_xml):
+                pending.append(image)
+                yield os.path.abspath(os.path.join(source_folder,
+                                                   image.get('file')))
+
+        with open(output_xml, 'w', encoding='utf-8') as f:
+            f.write(HEADER)
+            for entry in self.__map(resize, images()):
+                image = pending.popleft()
+                self.manifest[entry.pop('image')] = entry
+                image.set('file', os.path.relpath(self.path(entry['key']),
+                                                  output_folder))
+                ImageStore.scale_image(image, entry['scale'])
+                f.write(et.tostring(image, encoding='unicode'))
+                f.write('\n')
+            f.write(FOOTER)
+
+        self.save()
+
+    def save(self):
+        filename = os.path.join(self.folder, MANIFEST)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(filename + '.tmp', filename)
+
+    def __map(self, resize, images):
+        def lookup(image):
+            entry = self.lookup(image)
+            if entry is None:
+                self.misses += 1
+                return None
+            return dict(entry, image=image)
+
+        if self.workers <= 1:
+            for image in images:
+                yield lookup(image) or resize(image)
+            return
+
+        from lib.WorkerPool import WorkerPool
+        with WorkerPool(self.workers, None, None) as pool:
+            yield from pool.map(resize, images, lookup=lookup)
+
+    @staticmethod
+    def __images(xml):
+        """Lazily yields the image elements of an imglab XML file"""
+        parent = None
+        for event, element in et.iterparse(xml, events=('start', 'end')):
+            if event == 'start' and element.tag == 'images':
+                parent = element
+            elif event == 'end' and element.tag == 'image':
+                yield element
+                parent.remove(element)
+
+    @staticmethod
+    def cached_path(folder, key):
+        return os.path.join(folder, key[:2], key + '.jpg')
+
+    @staticmethod
+    def resize(image, folder, max_size, quality=95):
+        """
+        Stores a resized copy of an image under the hash of its contents and
+        returns its manifest entry
+        """
+        stat = os.stat(image)
+        with open(image, 'rb') as f:
+            data = f.read()
+        key = hashlib.sha256(data + b':%d' % max_size).hexdigest()
+        target = ImageStore.cached_path(folder, key)
+
+        with Image.open(BytesIO(data)) as source:
+            size = source.size
+
+        if os.path.isfile(target):
+            with Image.open(target) as resized:
+                scale = resized.size[0] / size[0]
+        else:
+            scale = ImageStore.__resize(data, size, target, max_size, quality)
+
+        return {
+            'image': image,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'max_size': max_size,
+            'key': key,
+            'scale': scale,
+        }
+
+    @staticmethod
+    def __resize(data, size, target, max_size, quality):
+        frame = Frame.from_bytes(data, max_size=max_size)
+        source_width, source_height = size
+        scale = min(max_size / max(size), 1)
+        width = max(1, round(source_width * scale))
+        height = max(1, round(source_height * scale))
+
+        pixels = frame.data
+        if (width, height) != (frame.width, frame.height):
+            import cv2
+            pixels = cv2.resize(pixels, (width, height),
+                                interpolation=cv2.INTER_AREA)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        encoded = ImageWriter.encode(pixels, '.jpg', quality)
+        # workers may store the same contents at once, so each writes its own
+        # temporary file
+        temporary = '{}.{}.tmp'.format(target, os.getpid())
+        with open(temporary, 'wb') as f:
+            f.write(encoded)
+        os.replace(temporary, target)
+        return width / source_width
+
+    @staticmethod
+    def scale_image(image, scale):
+        """Scales the boxes and landmarks of an imglab image element"""
+        for box in image.iter('box'):
+            for key in ('left', 'top', 'width', 'height'):
+                box.set(key, str(round(int(box.get(key)) * scale)))
+            for part in box.iter('part'):
+                for key in ('x', 'y'):
+                    part.set(key, str(round(int(part.get(key)) * scale)))
@@ -0,0 +1,112 @@
+import collections
+import concurrent.futures
+import multiprocessing.util
+import os
+import sys
+import threading
+from lib.Instrumentation import Instrumentation
+
+IMAGE_FORMATS = ['jpg', 'png', 'webp']
+
+
+class ImageWriter:
+    """
+    Encodes and writes RGB images on a background thread pool so that encoding
+    overlaps with detection of the next image. At most max_pending writes are
+    queued; further writes wait for the oldest one to finish.
+
+    A write that fails is reported on stderr against its own file and
+    counted in failures, rather than raised from whichever later call waits
+    for it.
+    """
+    _shared = None
+    _lock = threading.Lock()
+
+    def __init__(self, threads=2, max_pending=None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.max_pending = max_pending or threads * 4
+        self.pending = collections.deque()
+        self.failures = 0
+        self.failures_lock = threading.Lock()
+
+    @staticmethod
+    def shared():
+        """Returns the writer shared by everything in this process"""
+        with ImageWriter._lock:
+            if ImageWriter._shared is None:
+                ImageWriter._shared = ImageWriter()
+                # worker processes exit without running atexit handlers, so
+                # use a multiprocessing finalizer to drain their writes
+                multiprocessing.util.Finalize(ImageWriter._shared,
+                                              ImageWriter._shared.close,
+                                              exitpriority=10)
+            return ImageWriter._shared
+
+    @staticmethod
+    def close_shared():
+        with ImageWriter._lock:
+            writer, ImageWriter._shared = ImageWriter._shared, None
+        if writer is not None:
+            writer.close()
+
+    def write(self, filename, image, quality=95):
+        self.submit(ImageWriter.__write, filename, image, quality)
+
+    def submit(self, fn, *args):
+        """
+        Runs fn(*args) on the writer's threads once there is room. The first
+        argument names the output in error messages.
+        """
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+
+        self.pending.append(self.executor.submit(self.__run, fn, args))
+
+    def flush(self):
+        while self.pending:
+            self.pending.popleft().result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+        if self.failures:
+            print('{} images could not be written'.format(self.failures),
+                  file=sys.stderr)
+
+    def __run(self, fn, args):
+        try:
+            with Instrumentation.current().stage('write'):
+                fn(*args)
+        except Exception as e:
+            with self.failures_lock:
+                self.failures += 1
+            print('could not write {}: {}'.format(args[0], e),
+                  file=sys.stderr)
+
+    @staticmethod
+    def encode(image, ext, quality=95):
+        """Encodes an RGB image to the format named by ext, e.g. '.jpg'"""
+        import cv2
+        ext = ext.lower()
+        if ext in ('.jpg', '.jpeg'):
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif ext == '.webp':
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        else:
+            params = []
+
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+        ok, data = cv2.imencode(ext, image, params)
+        if not ok:
+            raise IOError('could not encode image as {}'.format(ext))
+        return data
+
+    @staticmethod
+    def __write(filename, image, quality):
+        data = ImageWriter.encode(image, os.path.splitext(filename)[1], quality)
+        with open(filename, 'wb') as f:
+            f.write(data)
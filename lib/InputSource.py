@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+import tarfile
+import zipfile
+from lib.ImageScanner import IMAGE_EXTENSIONS
+
+
+class InputSource:
+    """
+    Lazily yields the images to process from sources other than a folder on
+    disk. An image is either a path to read from disk or a (name, bytes)
+    tuple that is decoded from memory, so tar and zip members and images
+    piped through stdin are never written to temporary files.
+    """
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def name(image):
+        return image if isinstance(image, str) else image[0]
+
+    @staticmethod
+    def read(image):
+        if not isinstance(image, str):
+            return image[1]
+        with open(image, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def frame(image, max_size=None):
+        from lib.Frame import Frame
+        if isinstance(image, str):
+            return Frame.load(image, max_size)
+        return Frame.from_bytes(image[1], image[0], max_size)
+
+    @staticmethod
+    def archive(path, extensions=IMAGE_EXTENSIONS):
+        """
+        Streams the images in a tar archive, compressed or not, or a zip
+        archive one member at a time, named <archive>/<member>
+        """
+        extensions = {'.' + e.lower().lstrip('.') for e in extensions}
+
+        def wanted(name):
+            return os.path.splitext(name)[1].lower() in extensions
+
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and wanted(info.filename):
+                        yield (os.path.join(path, info.filename),
+                               archive.read(info))
+            return
+
+        # stream mode reads members in order without seeking, which also
+        # works for gzip, bzip2 and xz compressed archives
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and wanted(member.name):
+                    yield (os.path.join(path, member.name),
+                           archive.extractfile(member).read())
+
+    @staticmethod
+    def paths(stream):
+        """
+        Yields the images listed one per line in a text stream. http and
+        https URLs are downloaded, anything else is a path on disk.
+        """
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(('http://', 'https://')):
+                yield line, InputSource.__download(line)
+            else:
+                yield line
+
+    @staticmethod
+    def boxes(stream):
+        """
+        Yields an (image, boxes) pair for every JSON Lines record in a text
+        stream, with the Nx4 (left, top, right, bottom) boxes of its faces.
+        A record is either catfd -j output, with the boxes under "faces", or
+        {"image": <path>, "boxes": [[left, top, right, bottom], ...]}.
+        """
+        import numpy as np
+        for line in stream:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            boxes = record.get('boxes')
+            if boxes is None:
+                boxes = [[face['face'][key]
+                          for key in ('left', 'top', 'right', 'bottom')]
+                         for face in record['faces']]
+            boxes = np.array(boxes, dtype=np.int64)
+            yield record['image'], boxes.reshape(-1, 4)
+
+    @staticmethod
+    def stdin_image(stream=None):
+        """Returns the single encoded image piped through stdin"""
+        stream = stream or sys.stdin.buffer
+        return 'stdin', stream.read()
+
+    @staticmethod
+    def __download(url):
+        import requests
+        r = requests.get(url, timeout=60)
+        r.raise_for_status()
+        return r.content
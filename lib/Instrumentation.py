@@ -0,0 +1,183 @@
+import bisect
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# upper bounds in seconds of the histogram buckets kept for each stage
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+class Instrumentation:
+    """
+    Times named stages such as decode, detect, predict, crop, annotate and
+    write with context-manager timers. Timings are buffered per process until
+    drained, so worker processes can ship them back with their results, and
+    are then recorded to any number of sinks. Stages are only timed once
+    enabled, e.g. by adding a sink, so library callers that never drain do
+    not buffer timings forever. Threads that work on several items at once
+    capture the timings of each item instead.
+    """
+    _current = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.sinks = []
+        self.events = []
+        self.enabled = False
+        self.local = threading.local()
+
+    @staticmethod
+    def current():
+        """Returns the instrumentation shared by everything in this process"""
+        with Instrumentation._lock:
+            if Instrumentation._current is None:
+                Instrumentation._current = Instrumentation()
+            return Instrumentation._current
+
+    @staticmethod
+    def sink(spec):
+        """
+        Creates a sink from a spec: 'stderr' for a summary table on close,
+        'jsonl:<file>' for one JSON record per item, or 'prom:<file>' for a
+        Prometheus text file written on close
+        """
+        kind, _, path = spec.partition(':')
+        if kind == 'stderr':
+            return SummarySink()
+        if kind == 'jsonl' and path:
+            return JsonLinesSink(path)
+        if kind == 'prom' and path:
+            return PrometheusSink(path)
+        raise ValueError("unknown timing sink '{}'".format(spec))
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        self.enabled = True
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            events = getattr(self.local, 'events', None)
+            if events is None:
+                events = self.events
+            events.append((name, time.perf_counter() - start))
+
+    @contextlib.contextmanager
+    def capture(self):
+        """
+        Collects the stages timed by this thread into a list of their own,
+        e.g. for one item of a pipeline, rather than the shared buffer
+        """
+        previous = getattr(self.local, 'events', None)
+        self.local.events = []
+        try:
+            yield self.local.events
+        finally:
+            self.local.events = previous
+
+    def drain(self):
+        """Returns and clears the (stage, seconds) timings buffered so far"""
+        events, self.events = self.events, []
+        return events
+
+    def record(self, events, item=None):
+        """Passes the timings of one item, e.g. an image, to every sink"""
+        if not events:
+            return
+
+        stages = {}
+        for name, seconds in events:
+            stages[name] = stages.get(name, 0.0) + seconds
+
+        for sink in self.sinks:
+            sink.record(stages, item)
+
+    def close(self):
+        self.record(self.drain())
+        for sink in self.sinks:
+            sink.close()
+
+
+class SummarySink:
+    """Prints the count, total, mean and max time of each stage on close"""
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.stats = {}
+
+    def record(self, stages, item):
+        for name, seconds in stages.items():
+            count, total, peak = self.stats.get(name, (0, 0.0, 0.0))
+            self.stats[name] = (count + 1, total + seconds, max(peak, seconds))
+
+    def close(self):
+        print('{:<10} {:>8} {:>10} {:>10} {:>10}'.format(
+            'stage', 'count', 'total s', 'mean ms', 'max ms'),
+            file=self.stream)
+        for name, (count, total, peak) in self.stats.items():
+            print('{:<10} {:>8} {:>10.3f} {:>10.2f} {:>10.2f}'.format(
+                name, count, total, total / count * 1000, peak * 1000),
+                file=self.stream)
+
+
+class JsonLinesSink:
+    """Writes one JSON record of stage timings per item as it happens"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def record(self, stages, item):
+        self.file.write(json.dumps({'item': item, 'seconds': stages}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class PrometheusSink:
+    """
+    Keeps a histogram per stage and writes it on close in the Prometheus text
+    format, e.g. for the node exporter's textfile collector
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.histograms = {}
+
+    def record(self, stages, item):
+        for name, seconds in stages.items():
+            buckets, total = self.histograms.get(name,
+                                                 ([0] * len(BUCKETS), 0.0))
+            buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.histograms[name] = (buckets, total + seconds)
+
+    def close(self):
+        lines = ['# TYPE catfd_stage_seconds histogram']
+        for name, (buckets, total) in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS, buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('catfd_stage_seconds_bucket{{stage="{}",le="{}"}} '
+                             '{}'.format(name, le, cumulative))
+            lines.append('catfd_stage_seconds_sum{{stage="{}"}} {}'.format(
+                name, total))
+            lines.append('catfd_stage_seconds_count{{stage="{}"}} {}'.format(
+                name, cumulative))
+
+        # write then rename so that collectors never read a partial file
+        temp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp, self.path)
@@ -0,0 +1,66 @@
+import dlib
+import hashlib
+import os
+import threading
+from lib.Trainer import DETECTOR_SVM
+from lib.Trainer import PREDICTOR_DAT
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of deserialized dlib models. Models are keyed by their
+    absolute path and the file mtime, so a retrained model on disk is picked
+    up automatically the next time it is requested.
+
+    FHOG detectors are not safe to run from several threads at once, so each
+    thread gets its own copy of a detector.
+    """
+    _models = {}
+    _digests = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def get(path, loader, per_thread=False):
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        key = (path, loader, threading.get_ident() if per_thread else None)
+
+        with ModelRegistry._lock:
+            cached = ModelRegistry._models.get(key)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, loader(path))
+                ModelRegistry._models[key] = cached
+
+        return cached[1]
+
+    @staticmethod
+    def detector(path=DETECTOR_SVM):
+        return ModelRegistry.get(path, dlib.fhog_object_detector, True)
+
+    @staticmethod
+    def predictor(path=PREDICTOR_DAT):
+        return ModelRegistry.get(path, dlib.shape_predictor)
+
+    @staticmethod
+    def digest(path):
+        """Returns the SHA-256 hex digest of a model file"""
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+
+        with ModelRegistry._lock:
+            cached = ModelRegistry._digests.get(path)
+            if cached is None or cached[0] != mtime:
+                with open(path, 'rb') as f:
+                    cached = (mtime, hashlib.sha256(f.read()).hexdigest())
+                ModelRegistry._digests[path] = cached
+
+        return cached[1]
+
+    @staticmethod
+    def clear():
+        with ModelRegistry._lock:
+            ModelRegistry._models.clear()
+            ModelRegistry._digests.clear()
@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+
+
+class Pipeline:
+    """
+    Runs items through a chain of named stages connected by bounded queues.
+    Every stage has its own threads, so a stage waiting on a slow disk
+    overlaps with stages busy decoding or detecting, and the queues keep at
+    most queue_size items waiting in front of each stage.
+
+    A stage may return Pipeline.done(value) to skip the remaining stages,
+    e.g. for a cache hit. An exception raised by a stage is re-raised when
+    its item reaches the consumer.
+    """
+
+    class Done:
+        __slots__ = ('value',)
+
+        def __init__(self, value):
+            self.value = value
+
+    class Failed:
+        __slots__ = ('error',)
+
+        def __init__(self, error):
+            self.error = error
+
+    END = object()
+    _lock = threading.Lock()
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+
+    @staticmethod
+    def done(value):
+        return Pipeline.Done(value)
+
+    def add(self, name, fn, threads=1):
+        self.stages.append({
+            'name': name,
+            'fn': fn,
+            'threads': max(int(threads), 1),
+            'items': 0,
+            'busy': 0.0,
+            'depth_total': 0,
+            'depth_max': 0,
+        })
+        return self
+
+    def run(self, items, ordered=True):
+        """
+        Yields the output of the last stage for every item, in input order
+        or in the order items finish
+        """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        queues.append(queue.Queue(self.queue_size))
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.__feed,
+                                    args=(items, queues[0], stop),
+                                    daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage['threads']]
+            for _ in range(stage['threads']):
+                threads.append(threading.Thread(
+                    target=self.__work,
+                    args=(stage, queues[i], queues[i + 1], stop, remaining,
+                          self.__thread_count(i + 1)),
+                    daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            pending = {}
+            expected = 0
+            while True:
+                entry = queues[-1].get()
+                if entry is Pipeline.END:
+                    break
+                if not ordered:
+                    yield Pipeline.__unwrap(entry[1])
+                    continue
+                pending[entry[0]] = entry[1]
+                while expected in pending:
+                    yield Pipeline.__unwrap(pending.pop(expected))
+                    expected += 1
+        finally:
+            stop.set()
+            for q in queues:
+                Pipeline.__drain(q)
+
+    def stats(self):
+        """Returns the items, busy seconds and queue depths of every stage"""
+        return [{
+            'stage': stage['name'],
+            'threads': stage['threads'],
+            'items': stage['items'],
+            'busy': stage['busy'],
+            'mean_depth': stage['depth_total'] / max(stage['items'], 1),
+            'max_depth': stage['depth_max'],
+        } for stage in self.stages]
+
+    def __thread_count(self, i):
+        # the consumer reads the last queue and needs a single end marker
+        return self.stages[i]['threads'] if i < len(self.stages) else 1
+
+    def __feed(self, items, first, stop):
+        index = 0
+        try:
+            for item in items:
+                if not Pipeline.__put(first, (index, item), stop):
+                    return
+                index += 1
+        except Exception as e:
+            # report a failing input iterator through the consumer
+            Pipeline.__put(first, (index, Pipeline.Failed(e)), stop)
+        for _ in range(self.__thread_count(0)):
+            Pipeline.__put(first, Pipeline.END, stop)
+
+    def __work(self, stage, source, target, stop, remaining, downstream):
+        while not stop.is_set():
+            entry = source.get()
+            if entry is Pipeline.END:
+                break
+
+            depth = source.qsize()
+            index, value = entry
+            if not isinstance(value, (Pipeline.Done, Pipeline.Failed)):
+                start = time.perf_counter()
+                try:
+                    value = stage['fn'](value)
+                except Exception as e:
+                    value = Pipeline.Failed(e)
+                elapsed = time.perf_counter() - start
+                with Pipeline._lock:
+                    stage['items'] += 1
+                    stage['busy'] += elapsed
+                    stage['depth_total'] += depth
+                    stage['depth_max'] = max(stage['depth_max'], depth)
+
+            if not Pipeline.__put(target, (index, value), stop):
+                return
+
+        with Pipeline._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            for _ in range(downstream):
+                Pipeline.__put(target, Pipeline.END, stop)
+
+    @staticmethod
+    def __put(q, entry, stop):
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @staticmethod
+    def __drain(q):
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+
+    @staticmethod
+    def __unwrap(value):
+        if isinstance(value, Pipeline.Failed):
+            raise value.error
+        if isinstance(value, Pipeline.Done):
+            return value.value
+        return value
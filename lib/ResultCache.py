@@ -0,0 +1,140 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """
+    On-disk SQLite cache of detection results. Entries are keyed by the
+    SHA-256 of the image contents together with the detector version (model
+    hashes and upsample setting), and the least recently used entries are
+    evicted once the stored results exceed max_bytes. Writes are committed
+    every commit_every results or commit_interval seconds, whichever comes
+    first, so a killed run keeps its progress. lookup, store and close may be
+    called from different threads.
+    """
+
+    def __init__(self, path, version, max_bytes=None, commit_every=100,
+                 commit_interval=30):
+        self.path = path
+        self.version = version
+        self.max_bytes = max_bytes
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.__committed = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.__pending = {}
+        self.__writes = 0
+        self.__lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                faces TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )''')
+        self.db.execute('''
+            CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)
+            ''')
+        self.size = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def key(self, image):
+        """Keys an image given as a path or as a (name, bytes) tuple"""
+        h = hashlib.sha256()
+        if isinstance(image, str):
+            with open(image, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        else:
+            h.update(image[1])
+        h.update(self.version.encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        row = self.db.execute('SELECT faces FROM results WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute('UPDATE results SET accessed = ? WHERE key = ?',
+                        (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, faces):
+        value = json.dumps(faces)
+        row = self.db.execute('SELECT size FROM results WHERE key = ?',
+                              (key,)).fetchone()
+        if row is not None:
+            self.size -= row[0]
+
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                        (key, value, len(value), time.time()))
+        self.size += len(value)
+        self.evict()
+
+        self.__writes += 1
+        if self.__writes % self.commit_every == 0 or \
+                time.monotonic() - self.__committed >= self.commit_interval:
+            self.db.commit()
+            self.__committed = time.monotonic()
+
+    def lookup(self, image):
+        """
+        Returns the cached result record for an image, or None on a miss. The
+        key of a miss is remembered so that store() can save its result.
+        """
+        key = self.key(image)
+        name = image if isinstance(image, str) else image[0]
+        with self.__lock:
+            faces = self.get(key)
+            if faces is None:
+                self.__pending[name] = key
+                return None
+
+        return {'image': name, 'faces': faces}
+
+    def store(self, result):
+        with self.__lock:
+            key = self.__pending.pop(result['image'], None)
+            if key is not None and 'error' not in result:
+                self.put(key, result['faces'])
+
+    def evict(self):
+        """Drops least recently used results until the cache fits max_bytes"""
+        if self.max_bytes is None or self.size <= self.max_bytes:
+            return
+
+        while self.size > self.max_bytes:
+            rows = self.db.execute(
+                'SELECT key, size FROM results ORDER BY accessed LIMIT 256'
+            ).fetchall()
+            if not rows:
+                break
+
+            for key, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+                self.size -= size
+
+    def stats(self):
+        return 'cache: {} hits, {} misses'.format(self.hits, self.misses)
+
+    def close(self):
+        with self.__lock:
+            self.db.commit()
+            self.db.close()
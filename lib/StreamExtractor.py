@@ -0,0 +1,69 @@
+import os
+import shutil
+import tarfile
+import threading
+
+
+class StreamExtractor:
+    """
+    Untars an archive from chunks fed to it while it is still downloading.
+    The chunks are piped to a background thread that extracts them into
+    folder.part, which finish() renames to folder once the download has
+    been verified.
+    """
+
+    def __init__(self, folder):
+        if os.path.exists(folder):
+            raise IOError('{} already exists'.format(folder))
+
+        self.folder = folder
+        self.partial = folder + '.part'
+        if os.path.isdir(self.partial):
+            shutil.rmtree(self.partial)
+        os.makedirs(self.partial)
+
+        read, write = os.pipe()
+        self.pipe = os.fdopen(write, 'wb')
+        self.error = None
+        self.thread = threading.Thread(target=self.__run,
+                                       args=(os.fdopen(read, 'rb'),),
+                                       daemon=True)
+        self.thread.start()
+
+    def feed(self, chunk):
+        if self.error:
+            raise self.error
+        self.pipe.write(chunk)
+
+    def close(self):
+        """Ends the stream and waits for extraction to finish"""
+        self.pipe.close()
+        self.thread.join()
+
+    def finish(self):
+        if self.error:
+            raise self.error
+        os.replace(self.partial, self.folder)
+
+    def discard(self):
+        shutil.rmtree(self.partial, ignore_errors=True)
+
+    def __run(self, stream):
+        with stream:
+            try:
+                with tarfile.open(fileobj=stream, mode='r|*') as tar:
+                    StreamExtractor.extract(tar, self.partial)
+            except Exception as e:
+                self.error = e
+            # drain the tar padding, or the rest of the stream after an
+            # error, so feed never blocks on a full pipe
+            while stream.read(1 << 16):
+                pass
+
+    @staticmethod
+    def extract(tar, folder):
+        # refuse absolute paths and links out of folder where supported
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(folder, filter='data')
+        else:
+            tar.extractall(folder)
@@ -1,10 +1,22 @@
 import dlib
 import os
+from lib.Instrumentation import Instrumentation
 
 DATA_DIR = 'data'
 DETECTOR_SVM = os.path.join(DATA_DIR, 'detector.svm')
 PREDICTOR_DAT = os.path.join(DATA_DIR, 'predictor.dat')
 
+# training options that can be overridden, e.g. by a hyperparameter sweep
+DETECTOR_OPTIONS = {
+    'C': 5,
+    'upsample_limit': 2,
+}
+PREDICTOR_OPTIONS = {
+    'oversampling_amount': 300,  # higher is better but increases training time
+    'nu': 0.05,
+    'tree_depth': 6,
+}
+
 
 class Trainer:
     training_data_dir = '../../../../data/'
@@ -19,6 +31,19 @@ class Trainer:
     validation_data_xml = 'validation_resized.xml'
     testing_data_xml = 'test_resized.xml'
 
+    # built from the .cat annotations, before resizing
+    dataset_xml = {
+        'train': 'training.xml',
+        'validation': 'validation.xml',
+        'test': 'test.xml',
+    }
+    resized_xml = {
+        'train': training_data_xml,
+        'validation': validation_data_xml,
+        'test': testing_data_xml,
+    }
+    image_store_dir = 'resized'
+
     # # original
     # training_data_dir = 'training_data'
     # training_data_xml = 'training.xml'
@@ -26,11 +51,23 @@ class Trainer:
     def __init__(self,
                  folder=training_data_dir,
                  cpu_cores=8,
-                 window_size=200):
+                 window_size=200,
+                 detector_options=None,
+                 predictor_options=None,
+                 detector_svm=DETECTOR_SVM,
+                 predictor_dat=PREDICTOR_DAT,
+                 verbose=True):
         self.folder = folder
         self.cpu_cores = cpu_cores
         self.xml = '{}/{}'.format(folder, self.training_data_xml)
         self.window_size = window_size
+        self.detector_options = dict(DETECTOR_OPTIONS,
+                                     **(detector_options or {}))
+        self.predictor_options = dict(PREDICTOR_OPTIONS,
+                                      **(predictor_options or {}))
+        self.detector_svm = detector_svm
+        self.predictor_dat = predictor_dat
+        self.verbose = verbose
 
         # added
         self.validation_xml = '{}/{}'.format(folder,
@@ -40,36 +77,50 @@ class Trainer:
         self.__print_training_message('object detector')
         opt = dlib.simple_object_detector_training_options()
         opt.add_left_right_image_flips = True
-        opt.C = 5
         opt.num_threads = self.cpu_cores
-        opt.be_verbose = True
+        opt.be_verbose = self.verbose
         opt.detection_window_size = self.window_size ** 2
-        opt.upsample_limit = 2
-        dlib.train_simple_object_detector(self.xml, DETECTOR_SVM, opt)
+        Trainer.__set_options(opt, self.detector_options)
+        with Instrumentation.current().stage('train_detector'):
+            dlib.train_simple_object_detector(self.xml, self.detector_svm,
+                                              opt)
 
     def test_object_detector(self):
-        print(dlib.test_simple_object_detector(
-            self.validation_xml, DETECTOR_SVM))
+        with Instrumentation.current().stage('test_detector'):
+            result = dlib.test_simple_object_detector(
+                self.validation_xml, self.detector_svm)
+        print(result)
+        return result
 
     def train_shape_predictor(self):
         self.__print_training_message('shape predictor')
         opt = dlib.shape_predictor_training_options()
-        opt.oversampling_amount = 300  # higher is better but increases training time
-        opt.nu = 0.05
-        opt.tree_depth = 6
         opt.num_threads = self.cpu_cores
-        opt.be_verbose = True
-        dlib.train_shape_predictor(self.xml, PREDICTOR_DAT, opt)
+        opt.be_verbose = self.verbose
+        Trainer.__set_options(opt, self.predictor_options)
+        with Instrumentation.current().stage('train_predictor'):
+            dlib.train_shape_predictor(self.xml, self.predictor_dat, opt)
 
     def test_shape_predictor(self):
-        print(dlib.test_shape_predictor(self.validation_xml, PREDICTOR_DAT))
+        with Instrumentation.current().stage('test_predictor'):
+            result = dlib.test_shape_predictor(self.validation_xml,
+                                               self.predictor_dat)
+        print(result)
+        return result
 
     def view_object_detector(self):
-        detector = dlib.simple_object_detector(DETECTOR_SVM)
+        detector = dlib.simple_object_detector(self.detector_svm)
         win_det = dlib.image_window()
         win_det.set_image(detector)
         dlib.hit_enter_to_continue()
 
+    @staticmethod
+    def __set_options(opt, options):
+        for key, value in options.items():
+            if not hasattr(opt, key):
+                raise ValueError('unknown training option: {}'.format(key))
+            setattr(opt, key, value)
+
     def __print_training_message(self, trainer):
         print(('Training {0} with {1} CPU cores.'.format(
             trainer, self.cpu_cores)))
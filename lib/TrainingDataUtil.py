@@ -1,7 +1,12 @@
+import hashlib
 import os
 import requests
 import sys
 import tarfile
+import time
+from lib.StreamExtractor import StreamExtractor
+
+CHUNK_SIZE = 1 << 20
 
 
 class TrainingDataUtil:
@@ -43,20 +48,118 @@ class TrainingDataUtil:
     @ staticmethod
     def extract_training_data():
         if not os.path.isdir(TrainingDataUtil.training_data_dir):
-            tar = tarfile.open(TrainingDataUtil.training_data_archive, 'r:gz')
-            tar.extractall()
-            tar.close()
+            with tarfile.open(TrainingDataUtil.training_data_archive,
+                              'r|gz') as tar:
+                StreamExtractor.extract(tar, '.')
 
     @ staticmethod
-    def download_training_data(url):
-        if not TrainingDataUtil.__confirm_if_archive():
+    def download_training_data(url, sha256=None, extract_to=None):
+        """
+        Downloads the training data archive without prompting, resuming a
+        partial download and skipping it if the archive already matches
+        sha256
+        """
+        archive = TrainingDataUtil.training_data_archive
+        if sha256 and os.path.isfile(archive) \
+                and TrainingDataUtil.sha256(archive) == sha256.lower():
+            print('{} is up to date'.format(archive))
             return
 
-        r = requests.get(url, stream=True)
-        with open(TrainingDataUtil.training_data_archive, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        TrainingDataUtil.fetch(url, archive, sha256, extract_to)
+
+    @ staticmethod
+    def fetch(url,
+              filename,
+              sha256=None,
+              extract_to=None,
+              chunk_size=CHUNK_SIZE,
+              progress=True):
+        """
+        Streams url to filename in large chunks, resuming from filename.part
+        with an HTTP Range request when a previous download was cut off. The
+        SHA-256 of the whole file is checked against sha256 before the file
+        is moved into place.
+
+        With extract_to, the archive is untarred while it downloads, see
+        StreamExtractor.
+        """
+        partial = filename + '.part'
+        offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+
+        with requests.get(url, headers=headers, stream=True) as r:
+            if offset and r.status_code == 416:
+                # the previous attempt already fetched everything
+                chunks = ()
+                total = offset
+            else:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    offset = 0
+                chunks = r.iter_content(chunk_size=chunk_size)
+                length = r.headers.get('Content-Length')
+                total = offset + int(length) if length else None
+
+            digest = hashlib.sha256()
+            extractor = StreamExtractor(extract_to) if extract_to else None
+            try:
+                sinks = [digest.update] + ([extractor.feed] if extractor
+                                           else [])
+                if offset:
+                    # what is already on disk still has to be hashed and
+                    # untarred before the rest arrives
+                    with open(partial, 'rb') as f:
+                        for chunk in iter(lambda: f.read(chunk_size), b''):
+                            for sink in sinks:
+                                sink(chunk)
+
+                done = offset
+                start = time.monotonic()
+                with open(partial, 'ab' if offset else 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        for sink in sinks:
+                            sink(chunk)
+                        done += len(chunk)
+                        if progress:
+                            TrainingDataUtil.__progress(
+                                done, total, (done - offset) /
+                                max(time.monotonic() - start, 1e-6))
+            finally:
+                if extractor:
+                    extractor.close()
+                if progress:
+                    sys.stderr.write('\n')
+
+        if sha256 and digest.hexdigest() != sha256.lower():
+            os.remove(partial)
+            if extractor:
+                extractor.discard()
+            raise IOError('{} failed SHA-256 verification, expected {} '
+                          'but got {}'.format(url, sha256, digest.hexdigest()))
+
+        os.replace(partial, filename)
+        if extractor:
+            extractor.finish()
+
+    @ staticmethod
+    def sha256(filename, chunk_size=CHUNK_SIZE):
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @ staticmethod
+    def __progress(done, total, rate):
+        mib = 2 ** 20
+        if total:
+            message = '{:.1f} of {:.1f} MiB ({:.0%}), {:.1f} MiB/s'.format(
+                done / mib, total / mib, done / total, rate / mib)
+        else:
+            message = '{:.1f} MiB, {:.1f} MiB/s'.format(done / mib, rate / mib)
+        sys.stderr.write('\r' + message)
+        sys.stderr.flush()
 
     @ staticmethod
     def __confirm(question, default="yes"):
@@ -0,0 +1,203 @@
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import random
+import time
+from lib.DetectorBenchmark import DetectorBenchmark
+from lib.Frame import Frame
+from lib.Trainer import Trainer
+
+MODELS = {
+    'detector': '.svm',
+    'predictor': '.dat',
+}
+
+
+class TrainingSweep:
+    """
+    Trains a detector or shape predictor for every combination of
+    hyperparameters in a grid or random search spec, running as many
+    trainings at once as fit in a CPU budget given the threads each one
+    uses. Every model is tested on the validation data and timed on a
+    sample of its images, and the results are ranked in a leaderboard.
+
+    A spec is a JSON object such as:
+
+        {"model": "detector", "search": "grid", "num_threads": 2,
+         "params": {"C": [1, 5, 10], "window_size": [60, 80]}}
+
+    With "search": "random", "samples" combinations are drawn, and a param
+    may also be a {"min": 1, "max": 10, "log": true} range.
+    """
+
+    def __init__(self,
+                 spec,
+                 folder=Trainer.training_data_dir,
+                 output_dir='sweep',
+                 cpu_budget=1,
+                 window_size=80,
+                 speed_images=50):
+        if spec.get('model') not in MODELS:
+            raise ValueError("spec model must be 'detector' or 'predictor'")
+
+        self.spec = spec
+        self.model = spec['model']
+        self.num_threads = int(spec.get('num_threads', 1))
+        self.folder = folder
+        self.output_dir = output_dir
+        self.cpu_budget = max(int(cpu_budget), self.num_threads)
+        self.window_size = window_size
+        self.speed_images = speed_images
+
+    @staticmethod
+    def load(filename, **kwargs):
+        with open(filename) as f:
+            return TrainingSweep(json.load(f), **kwargs)
+
+    def jobs(self):
+        """Returns the hyperparameters of every training in the sweep"""
+        params = self.spec.get('params', {})
+        if self.spec.get('search', 'grid') == 'grid':
+            names = sorted(params)
+            return [dict(zip(names, values)) for values in
+                    itertools.product(*(params[n] for n in names))]
+
+        rng = random.Random(self.spec.get('seed', 0))
+        return [{name: TrainingSweep.sample(rng, values)
+                 for name, values in sorted(params.items())}
+                for _ in range(int(self.spec.get('samples', 10)))]
+
+    def run(self):
+        """Runs every training and returns the leaderboard, best first"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        rows = []
+        slots = max(1, self.cpu_budget // self.num_threads)
+        with concurrent.futures.ProcessPoolExecutor(slots) as executor:
+            futures = {}
+            for i, params in enumerate(self.jobs()):
+                path = os.path.join(self.output_dir, '{}-{}{}'.format(
+                    self.model, i, MODELS[self.model]))
+                future = executor.submit(TrainingSweep.train,
+                                         self.model,
+                                         self.folder,
+                                         params,
+                                         path,
+                                         self.num_threads,
+                                         self.window_size,
+                                         self.speed_images)
+                futures[future] = {'model': path, 'params': params}
+
+            for future in concurrent.futures.as_completed(futures):
+                row = futures[future]
+                try:
+                    row.update(future.result())
+                except Exception as e:
+                    row['error'] = str(e)
+                rows.append(row)
+
+        leaderboard = TrainingSweep.rank(rows)
+        with open(os.path.join(self.output_dir, 'leaderboard.json'), 'w') as f:
+            json.dump(leaderboard, f, indent=2)
+        return leaderboard
+
+    @staticmethod
+    def sample(rng, values):
+        if isinstance(values, list):
+            return rng.choice(values)
+
+        low, high = values['min'], values['max']
+        if values.get('log'):
+            value = math.exp(rng.uniform(math.log(low), math.log(high)))
+        else:
+            value = rng.uniform(low, high)
+        if isinstance(low, int) and isinstance(high, int):
+            return int(round(value))
+        return value
+
+    @staticmethod
+    def train(model, folder, params, path, num_threads, window_size,
+              speed_images):
+        """Trains, tests and times one model in a worker process"""
+        params = dict(params)
+        t = Trainer(folder,
+                    num_threads,
+                    params.pop('window_size', window_size),
+                    detector_svm=path,
+                    predictor_dat=path,
+                    verbose=False,
+                    **{model + '_options': params})
+
+        start = time.perf_counter()
+        if model == 'detector':
+            t.train_object_detector()
+        else:
+            t.train_shape_predictor()
+        row = {
+            'train_seconds': time.perf_counter() - start,
+            'model_bytes': os.path.getsize(path),
+        }
+
+        images = DetectorBenchmark.load_boxes(t.validation_xml)[:speed_images]
+        if model == 'detector':
+            result = t.test_object_detector()
+            row.update(precision=result.precision,
+                       recall=result.recall,
+                       average_precision=result.average_precision,
+                       per_second=TrainingSweep.detector_speed(path, images))
+        else:
+            row.update(mean_error=t.test_shape_predictor(),
+                       per_second=TrainingSweep.predictor_speed(path, images))
+        return row
+
+    @staticmethod
+    def detector_speed(path, images):
+        """Images per second the detector at path finds faces in"""
+        import dlib
+        detector = dlib.fhog_object_detector(path)
+        elapsed = 0.0
+        for filename, _ in images:
+            image_data = Frame.load(filename).data
+            start = time.perf_counter()
+            detector(image_data, 1)
+            elapsed += time.perf_counter() - start
+        return len(images) / elapsed if elapsed else 0.0
+
+    @staticmethod
+    def predictor_speed(path, images):
+        """Faces per second the shape predictor at path finds landmarks of"""
+        import dlib
+        predictor = dlib.shape_predictor(path)
+        elapsed = 0.0
+        faces = 0
+        for filename, boxes in images:
+            image_data = Frame.load(filename).data
+            rects = [dlib.rectangle(*(int(v) for v in box)) for box in boxes]
+            start = time.perf_counter()
+            for rect in rects:
+                predictor(image_data, rect)
+            elapsed += time.perf_counter() - start
+            faces += len(rects)
+        return faces / elapsed if elapsed else 0.0
+
+    @staticmethod
+    def rank(rows):
+        """
+        Sorts rows by accuracy, then speed, and marks the rows that no other
+        row beats on both as pareto
+        """
+        def accuracy(row):
+            if 'average_precision' in row:
+                return row['average_precision']
+            return -row['mean_error']
+
+        done = [row for row in rows if 'error' not in row]
+        done.sort(key=lambda row: (accuracy(row), row['per_second']),
+                  reverse=True)
+        fastest = -1.0
+        for row in done:
+            row['pareto'] = row['per_second'] > fastest
+            fastest = max(fastest, row['per_second'])
+
+        return done + [row for row in rows if 'error' in row]
@@ -0,0 +1,135 @@
+import cv2
+import dlib
+import queue
+import threading
+from lib.DetectorResult import DetectorResult
+
+
+class VideoDetector:
+    """
+    Detects cat faces in a video file or camera stream. Frames are decoded on
+    a producer thread. The FHOG detector only runs every detect_every frames,
+    or sooner when motion is detected, and in between the boxes are carried
+    forward with dlib correlation trackers. Landmarks are predicted on every
+    frame.
+    """
+
+    def __init__(self,
+                 detector,
+                 detect_every=10,
+                 motion_threshold=None,
+                 min_track_quality=7.0,
+                 buffer_size=8):
+        self.detector = detector
+        self.detect_every = max(1, detect_every)
+        self.motion_threshold = motion_threshold
+        self.min_track_quality = min_track_quality
+        self.buffer_size = buffer_size
+
+    def run(self, source):
+        """
+        Yields (frame index, timestamp in ms, DetectorResult) for each frame
+        of source, which is a video path or a camera index
+        """
+        trackers = []
+        previous = None
+        last_detection = None
+
+        for index, timestamp, image in self.frames(source):
+            small = None
+            motion = False
+            if self.motion_threshold is not None:
+                small = VideoDetector.__motion_image(image)
+                motion = previous is not None and cv2.absdiff(
+                    small, previous).mean() > self.motion_threshold
+                previous = small
+
+            if (last_detection is None or motion or
+                    index - last_detection >= self.detect_every):
+                faces = self.detector.find_faces(image)
+                trackers = []
+                for face in faces:
+                    tracker = dlib.correlation_tracker()
+                    tracker.start_track(image, face)
+                    trackers.append(tracker)
+                last_detection = index
+            else:
+                faces = dlib.rectangles()
+                tracked = []
+                for tracker in trackers:
+                    if tracker.update(image) < self.min_track_quality:
+                        continue
+                    position = tracker.get_position()
+                    faces.append(dlib.rectangle(round(position.left()),
+                                                round(position.top()),
+                                                round(position.right()),
+                                                round(position.bottom())))
+                    tracked.append(tracker)
+                trackers = tracked
+
+            shapes = self.detector.predict(image, faces)
+            yield index, timestamp, DetectorResult.from_dlib(faces, shapes)
+
+    def frames(self, source):
+        """
+        Yields (frame index, timestamp in ms, RGB image) tuples decoded by a
+        background thread into a bounded queue
+        """
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise IOError('could not open video {}'.format(source))
+
+        frames = queue.Queue(self.buffer_size)
+        stop = threading.Event()
+        thread = threading.Thread(target=VideoDetector.__decode,
+                                  args=(capture, frames, stop),
+                                  daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            stop.set()
+            thread.join()
+            capture.release()
+
+    @staticmethod
+    def __decode(capture, frames, stop):
+        index = 0
+        try:
+            while not stop.is_set():
+                ok, image = capture.read()
+                if not ok:
+                    break
+                frame = (index,
+                         capture.get(cv2.CAP_PROP_POS_MSEC),
+                         cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+                VideoDetector.__put(frames, frame, stop)
+                index += 1
+        finally:
+            VideoDetector.__put(frames, None, stop)
+
+    @staticmethod
+    def __put(frames, item, stop):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    @staticmethod
+    def __motion_image(image):
+        height, width = image.shape[:2]
+        scale = 160 / max(width, 1)
+        small = cv2.resize(image, (160, max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
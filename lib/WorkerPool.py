@@ -0,0 +1,90 @@
+import collections
+import concurrent.futures
+from lib.Instrumentation import Instrumentation
+from lib.ModelRegistry import ModelRegistry
+from lib.Trainer import DETECTOR_SVM
+from lib.Trainer import PREDICTOR_DAT
+
+
+class WorkerPool:
+    """
+    Spreads work across a pool of processes. Each worker loads the FHOG
+    detector, or list of detectors, and the shape predictor once in its
+    initializer, skipping any path that is None, and at most max_in_flight
+    tasks are queued at a time so memory stays flat no matter how many
+    inputs are fed in. Workers time their stages when the parent does.
+    """
+
+    def __init__(self,
+                 workers,
+                 detector_svm=DETECTOR_SVM,
+                 predictor_dat=PREDICTOR_DAT,
+                 max_in_flight=None):
+        self.workers = workers
+        self.max_in_flight = max_in_flight or workers * 2
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=WorkerPool._initialize,
+            initargs=(detector_svm, predictor_dat,
+                      Instrumentation.current().enabled))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def map(self, fn, iterable, ordered=True, lookup=None):
+        """
+        Yields fn(item) for every item, either in input order or in the order
+        the results complete. If lookup returns a result for an item, that
+        result is used in its place and fn is not run.
+        """
+        pending = collections.deque() if ordered else set()
+
+        for item in iterable:
+            if len(pending) >= self.max_in_flight:
+                yield from WorkerPool._drain(pending, ordered)
+
+            result = lookup(item) if lookup else None
+            if result is None:
+                future = self.executor.submit(fn, item)
+            else:
+                future = concurrent.futures.Future()
+                future.set_result(result)
+
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+
+        while pending:
+            yield from WorkerPool._drain(pending, ordered)
+
+    @staticmethod
+    def _drain(pending, ordered):
+        if ordered:
+            yield pending.popleft().result()
+            return
+
+        done, _ = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+    @staticmethod
+    def _initialize(detector_svm, predictor_dat, timings=False):
+        Instrumentation.current().enabled = timings
+        if isinstance(detector_svm, str):
+            detector_svm = [detector_svm]
+        for path in detector_svm or ():
+            ModelRegistry.detector(path)
+        if predictor_dat:
+            ModelRegistry.predictor(predictor_dat)
@@ -0,0 +1,127 @@
+import hashlib
+import http.server
+import io
+import os
+import tarfile
+import threading
+import pytest
+from lib.TrainingDataUtil import TrainingDataUtil
+
+
+def archive():
+    """A small tar.gz holding one file, large enough to span many chunks"""
+    data = os.urandom(1 << 16)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        info = tarfile.TarInfo('training_data/data.bin')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue(), data
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's payload, honouring Range unless told not to"""
+
+    def do_GET(self):
+        payload = self.server.payload
+        header = self.headers.get('Range')
+        self.server.ranges.append(header)
+        start = 0
+        if header and self.server.honour_range:
+            start = int(header[len('bytes='):].rstrip('-'))
+            if start >= len(payload):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(payload)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(payload) - 1, len(payload)))
+        else:
+            self.send_response(200)
+
+        body = payload[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.payload, httpd.data = archive()
+    httpd.sha256 = hashlib.sha256(httpd.payload).hexdigest()
+    httpd.honour_range = True
+    httpd.ranges = []
+    httpd.url = 'http://127.0.0.1:{}/training_data.tar.gz'.format(
+        httpd.server_address[1])
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(server, filename, sha256=None, extract_to=None):
+    TrainingDataUtil.fetch(server.url, str(filename), sha256 or server.sha256,
+                           str(extract_to) if extract_to else None,
+                           chunk_size=4096, progress=False)
+
+
+def extracted(folder):
+    with open(os.path.join(str(folder), 'training_data', 'data.bin'),
+              'rb') as f:
+        return f.read()
+
+
+def test_resumes_from_part_file(server, tmp_path):
+    filename = tmp_path / 'training_data.tar.gz'
+    half = len(server.payload) // 2
+    (tmp_path / 'training_data.tar.gz.part').write_bytes(
+        server.payload[:half])
+
+    fetch(server, filename, extract_to=tmp_path / 'data')
+
+    assert server.ranges == ['bytes={}-'.format(half)]
+    assert filename.read_bytes() == server.payload
+    assert not (tmp_path / 'training_data.tar.gz.part').exists()
+    assert extracted(tmp_path / 'data') == server.data
+
+
+def test_restarts_when_server_ignores_range(server, tmp_path):
+    server.honour_range = False
+    filename = tmp_path / 'training_data.tar.gz'
+    (tmp_path / 'training_data.tar.gz.part').write_bytes(b'stale' * 100)
+
+    fetch(server, filename, extract_to=tmp_path / 'data')
+
+    assert server.ranges == ['bytes=500-']
+    assert filename.read_bytes() == server.payload
+    assert extracted(tmp_path / 'data') == server.data
+
+
+def test_complete_part_file_is_verified(server, tmp_path):
+    filename = tmp_path / 'training_data.tar.gz'
+    (tmp_path / 'training_data.tar.gz.part').write_bytes(server.payload)
+
+    fetch(server, filename)
+
+    assert server.ranges == ['bytes={}-'.format(len(server.payload))]
+    assert filename.read_bytes() == server.payload
+
+
+def test_checksum_mismatch_removes_partial_files(server, tmp_path):
+    filename = tmp_path / 'training_data.tar.gz'
+    with pytest.raises(IOError):
+        fetch(server, filename, sha256='0' * 64,
+              extract_to=tmp_path / 'data')
+
+    assert not filename.exists()
+    assert not (tmp_path / 'training_data.tar.gz.part').exists()
+    assert not (tmp_path / 'data').exists()
+    assert not (tmp_path / 'data.part').exists()
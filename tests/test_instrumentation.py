@@ -0,0 +1,29 @@
+from lib.Instrumentation import Instrumentation
+from lib.Instrumentation import SummarySink
+
+
+def test_stage_is_not_buffered_without_sink():
+    timings = Instrumentation()
+    with timings.stage('detect'):
+        pass
+    assert timings.drain() == []
+
+
+def test_stage_is_buffered_with_sink():
+    timings = Instrumentation()
+    timings.add_sink(SummarySink())
+    with timings.stage('detect'):
+        pass
+    assert [name for name, _ in timings.drain()] == ['detect']
+
+
+def test_capture_keeps_item_timings_apart():
+    timings = Instrumentation()
+    timings.add_sink(SummarySink())
+    with timings.capture() as events:
+        with timings.stage('decode'):
+            pass
+    with timings.stage('write'):
+        pass
+    assert [name for name, _ in events] == ['decode']
+    assert [name for name, _ in timings.drain()] == ['write']
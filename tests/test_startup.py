@@ -0,0 +1,7 @@
+import bench
+
+
+def test_help_starts_within_budget():
+    result = bench.check_startup(bench.STARTUP_TARGET_MS)
+    assert not result['heavy_imports'], result
+    assert result['ok'], result
@@ -0,0 +1,32 @@
+import glob
+import os
+import numpy as np
+import pytest
+from lib.Detector import Detector
+from lib.Frame import Frame
+
+TILE_SIZE = 1500
+SAMPLES = sorted(glob.glob(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'samples', '*.jpg')))
+
+
+@pytest.fixture(scope='module')
+def pooled():
+    d = Detector(tile_size=TILE_SIZE, tile_workers=2)
+    yield d
+    d.close()
+
+
+@pytest.mark.parametrize('filename', SAMPLES)
+def test_serial_and_pooled_tiles_agree(filename, pooled):
+    image = Frame.load(filename).data
+    serial = Detector(tile_size=TILE_SIZE)
+    expected, _, _ = serial.find_scored_faces(image)
+    found, _, _ = pooled.find_scored_faces(image)
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_serial_tiles_find_face():
+    image = Frame.load('samples/nero.jpg').data
+    boxes, _, _ = Detector(tile_size=TILE_SIZE).find_scored_faces(image)
+    assert len(boxes) == 1
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import multiprocessing
 import os
+from lib.DatasetBuilder import DatasetBuilder
+from lib.DetectorBenchmark import DetectorBenchmark
+from lib.ImageStore import ImageStore
+from lib.Instrumentation import Instrumentation
 from lib.Trainer import Trainer
 from lib.TrainingDataUtil import TrainingDataUtil
+from lib.TrainingSweep import TrainingSweep
 
 
 def main():
@@ -49,9 +55,26 @@ def main():
                         action='store_true')
 
     parser.add_argument('-u', '--source-url',
-                        help='download training data from url',
+                        help='''
+                        download training data from url, resuming a partial
+                        download
+                        ''',
                         metavar='<url>')
 
+    parser.add_argument('--sha256',
+                        help='''
+                        expected SHA-256 of the downloaded training data;
+                        the download is skipped if the archive matches
+                        ''',
+                        metavar='<hex>')
+
+    parser.add_argument('--extract-to',
+                        help='''
+                        untar the training data into a new folder while it
+                        downloads
+                        ''',
+                        metavar='<folder>')
+
     parser.add_argument('-a', '--archive',
                         help='''
                         compress current training data directory to tar gzip
@@ -59,6 +82,40 @@ def main():
                         ''',
                         action='store_true')
 
+    parser.add_argument('-b', '--build-dataset',
+                        help='''
+                        build the training, validation and testing XML files
+                        from the images and .cat annotations in a folder
+                        ''',
+                        metavar='<folder>')
+
+    parser.add_argument('--split',
+                        help='''
+                        fractions of the images for training, validation and
+                        testing when building a dataset
+                        ''',
+                        type=float,
+                        default=[0.8, 0.1, 0.1],
+                        nargs=3,
+                        metavar='<float>')
+
+    parser.add_argument('-r', '--resize-dataset',
+                        help='''
+                        resize the images of the built dataset to at most
+                        this many pixels on their longest side for training,
+                        reusing images resized in earlier runs
+                        ''',
+                        type=int,
+                        metavar='<px>')
+
+    parser.add_argument('--image-store',
+                        help='''
+                        folder holding the resized images and their manifest
+                        ''',
+                        default=os.path.join(Trainer.training_data_dir,
+                                             Trainer.image_store_dir),
+                        metavar='<folder>')
+
     parser.add_argument('-i', '--imglab',
                         help='''
                         Open imglab session for current training data
@@ -78,14 +135,96 @@ def main():
     parser.add_argument('-dt', '--test-detector',
                         help='tst predictor for accuracy recall and f1',
                         action="store_true")
+    parser.add_argument('-db', '--bench-detector',
+                        help='''
+                        measure detector speed against recall on the
+                        validation data for each upsample and max size
+                        ''',
+                        action='store_true')
+
+    parser.add_argument('-bu', '--bench-upsample',
+                        help='upsample factors to benchmark',
+                        type=int,
+                        default=[0, 1, 2],
+                        nargs='+',
+                        metavar='<int>')
+
+    parser.add_argument('-bm', '--bench-max-size',
+                        help='''
+                        max image sizes to benchmark, 0 for full resolution
+                        ''',
+                        type=int,
+                        default=[0, 2048, 1024],
+                        nargs='+',
+                        metavar='<px>')
+
+    parser.add_argument('-s', '--sweep',
+                        help='''
+                        train a detector or shape predictor for each set of
+                        hyperparameters in a grid or random search spec file,
+                        running as many at once as -c cores allow, and rank
+                        them by accuracy and speed
+                        ''',
+                        metavar='<spec.json>')
+
+    parser.add_argument('--sweep-output',
+                        help='folder for the sweep models and leaderboard',
+                        default='sweep',
+                        metavar='<folder>')
+
+    parser.add_argument('--timings',
+                        help='''
+                        report training and testing times to a sink: stderr,
+                        jsonl:<file> or prom:<file>; may be repeated
+                        ''',
+                        action='append',
+                        default=[],
+                        metavar='<sink>')
+
+    parser.add_argument('--profile',
+                        help='write cProfile statistics to a file',
+                        metavar='<file>')
     args = vars(parser.parse_args())
 
+    timings = Instrumentation.current()
+    try:
+        for spec in args['timings']:
+            timings.add_sink(Instrumentation.sink(spec))
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    if args['profile']:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, args)
+        finally:
+            profiler.dump_stats(args['profile'])
+    else:
+        run(args)
+
+    timings.record(timings.drain(), 'train')
+    timings.close()
+
+
+def run(args):
+    """ Runs the tasks selected on the command line"""
     if args['source_url']:
-        TrainingDataUtil.download_training_data(args['source_url'])
+        TrainingDataUtil.download_training_data(args['source_url'],
+                                                args['sha256'],
+                                                args['extract_to'])
 
     if args['archive']:
         TrainingDataUtil.archive_training_data()
 
+    if args['build_dataset']:
+        build_dataset(args['build_dataset'], args['split'],
+                      args['cpu_cores'])
+
+    if args['resize_dataset']:
+        resize_dataset(args['image_store'], args['resize_dataset'],
+                       args['cpu_cores'])
+
     if args['train_all']:
         train_detector(args['cpu_cores'], args['window_size'])
         train_predictor(args['cpu_cores'])
@@ -124,6 +263,34 @@ def main():
     if args['test_detector']:
         test_detector()
 
+    if args['bench_detector']:
+        bench_detector(args['bench_upsample'], args['bench_max_size'])
+
+    if args['sweep']:
+        sweep(args['sweep'], args['sweep_output'], args['cpu_cores'],
+              args['window_size'])
+
+
+def build_dataset(folder, split, cpu_cores):
+    builder = DatasetBuilder(folder, split, max(int(cpu_cores), 1))
+    outputs = {name: os.path.join(Trainer.training_data_dir, xml)
+               for name, xml in Trainer.dataset_xml.items()}
+    counts = builder.build(outputs)
+    for name, count in counts.items():
+        print('{} images in {}'.format(count, outputs[name]))
+
+
+def resize_dataset(folder, max_size, cpu_cores):
+    store = ImageStore(folder, max_size, workers=max(int(cpu_cores), 1))
+    for name, xml in Trainer.dataset_xml.items():
+        source = os.path.join(Trainer.training_data_dir, xml)
+        output = os.path.join(Trainer.training_data_dir,
+                              Trainer.resized_xml[name])
+        if os.path.isfile(source):
+            store.resize_dataset(source, output)
+    print('{} images resized, {} reused from {}'.format(
+        store.misses, store.hits, folder))
+
 
 def train_predictor(cpu_cores):
     # TrainingDataUtil.extract_training_data()
@@ -147,6 +314,41 @@ def test_detector():
     t.test_object_detector()
 
 
+def bench_detector(upsamples, max_sizes):
+    t = Trainer(Trainer.training_data_dir)
+    bench = DetectorBenchmark(t.validation_xml)
+    print('upsample  max size  images/s  recall  precision')
+    for r in bench.sweep(upsamples, [m or None for m in max_sizes]):
+        print('{:>8}  {:>8}  {:>8.2f}  {:>6.3f}  {:>9.3f}'.format(
+            r['upsample'],
+            r['max_size'] or 'full',
+            r['images_per_second'],
+            r['recall'],
+            r['precision']))
+
+
+def sweep(spec, output_dir, cpu_cores, window_size):
+    s = TrainingSweep.load(spec,
+                           output_dir=output_dir,
+                           cpu_budget=max(int(cpu_cores), 1),
+                           window_size=window_size)
+    accuracy = 'AP' if s.model == 'detector' else 'error'
+    print('model  {}  speed  size  params, * when no model is both more '
+          'accurate and faster'.format(accuracy))
+    for row in s.run():
+        if 'error' in row:
+            print('{}  failed: {}'.format(row['model'], row['error']))
+            continue
+        accuracy = row.get('average_precision', row.get('mean_error'))
+        print('{}  {:>8.4f}  {:>8.2f}/s  {:>9}B  {}{}'.format(
+            row['model'],
+            accuracy,
+            row['per_second'],
+            row['model_bytes'],
+            json.dumps(row['params']),
+            '  *' if row['pareto'] else ''))
+
+
 def view_object_detector_svm():
     t = Trainer(Trainer.training_data_dir)
     t.view_object_detector()